@@ -1,9 +1,9 @@
-import sqlite3
 import time
 import json
 import re
 import os
 from .health_agent import HealthAgent
+from database.connection import get_connection, transaction
 
 class FFXIAgent:
     def __init__(self, agent_id=None, character_name=None, db_path="context/context.db"):
@@ -23,11 +23,9 @@ class FFXIAgent:
     
     def load_agent(self, agent_id):
         """Load agent data from the database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT name, character_id, capabilities, status FROM agents WHERE id = ?', (agent_id,))
-        result = cursor.fetchone()
-        conn.close()
+        result = get_connection(self.db_path).execute(
+            'SELECT name, character_id, capabilities, status FROM agents WHERE id = ?', (agent_id,)
+        ).fetchone()
         
         if result:
             name, character_id, capabilities, status = result
@@ -40,55 +38,51 @@ class FFXIAgent:
     
     def create_agent(self, character_name):
         """Create a new agent for a character"""
-        character_id = self.get_character_id(character_name)
-        if not character_id:
-            return False
-            
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
         capabilities = json.dumps(["basic"])
-        cursor.execute(
-            'INSERT INTO agents (name, character_id, capabilities, status) VALUES (?, ?, ?, ?)',
-            (f"Agent-{character_name}", character_id, capabilities, "ready")
-        )
-        self.agent_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with transaction(self.db_path) as cursor:
+            # Look up the character and reuse its agent row (and capabilities) if it has one
+            cursor.execute(
+                '''INSERT INTO agents (name, character_id, capabilities, status)
+                   SELECT ?, id, ?, ? FROM characters WHERE name = ? ORDER BY id LIMIT 1
+                   ON CONFLICT(character_id) DO UPDATE SET status = excluded.status''',
+                (f"Agent-{character_name}", capabilities, "ready", character_name)
+            )
+            result = cursor.execute(
+                '''SELECT id, capabilities FROM agents
+                   WHERE character_id = (SELECT id FROM characters WHERE name = ? ORDER BY id LIMIT 1)''',
+                (character_name,)
+            ).fetchone()
+        if not result:
+            return False
+        self.agent_id, capabilities = result
         
         self.character_name = character_name
-        self.capabilities = ["basic"]
+        self.capabilities = json.loads(capabilities) if capabilities else ["basic"]
         self.status = "ready"
         return True
     
     def get_character_id(self, character_name):
         """Get character ID from name"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT id FROM characters WHERE name = ?', (character_name,))
-        result = cursor.fetchone()
-        conn.close()
+        result = get_connection(self.db_path).execute(
+            'SELECT id FROM characters WHERE name = ?', (character_name,)
+        ).fetchone()
         return result[0] if result else None
     
     def get_character_name(self, character_id):
         """Get character name from ID"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT name FROM characters WHERE id = ?', (character_id,))
-        result = cursor.fetchone()
-        conn.close()
+        result = get_connection(self.db_path).execute(
+            'SELECT name FROM characters WHERE id = ?', (character_id,)
+        ).fetchone()
         return result[0] if result else None
     
     def add_capability(self, capability):
         """Add a new capability to the agent"""
         if capability not in self.capabilities:
             self.capabilities.append(capability)
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
             capabilities_json = json.dumps(self.capabilities)
-            cursor.execute('UPDATE agents SET capabilities = ? WHERE id = ?', 
-                          (capabilities_json, self.agent_id))
-            conn.commit()
-            conn.close()
+            with transaction(self.db_path) as cursor:
+                cursor.execute('UPDATE agents SET capabilities = ? WHERE id = ?', 
+                              (capabilities_json, self.agent_id))
             return True
         return False
     
@@ -142,16 +136,11 @@ class FFXIAgent:
 
 def get_all_agents(db_path="context/context.db"):
     """Get all agents from the database"""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute('''
+    return get_connection(db_path).execute('''
         SELECT a.id, a.name, c.name as character_name, a.status 
         FROM agents a
         JOIN characters c ON a.character_id = c.id
-    ''')
-    agents = cursor.fetchall()
-    conn.close()
-    return agents
+    ''').fetchall()
 
 def process_instruction(instruction, db_path="context/context.db"):
     """Process an instruction and assign it to the appropriate agent"""
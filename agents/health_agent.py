@@ -27,6 +27,7 @@ logger.addFilter(message_filter)
 
 # Add import for state store
 from .state_store import state_store
+from database.vitals_store import get_vitals_store
 
 # Filter out the specific missing ScriptRunContext warnings
 warnings.filterwarnings("ignore", message=".*missing ScriptRunContext.*")
@@ -52,6 +53,7 @@ class HealthAgent:
         self.error_message = None
         self.monitoring_thread = None
         self.cadence = cadence
+        self.vitals_store = get_vitals_store()  # History of every sample for trend charts
         logger.info(f"Initialized HealthAgent for {character_name}, JSON file path: {self.json_file}")
     
     def _find_json_file(self):
@@ -235,6 +237,9 @@ class HealthAgent:
                                 # This sends all character data to the state store
                                 state_store.update_character_data(self.character_name, character_data)
                                 
+                                # Keep the sample in the vitals history (queued, written in batches)
+                                self.vitals_store.record(self.character_name, character_data)
+                                
                                 # Additionally update the "is_running" status
                                 state_store.set_state(f"{self.character_name}:status", {
                                     "is_running": self.is_running,
@@ -1,16 +1,30 @@
 import streamlit as st
-import requests
 import json
 from utils.retriever_pipeline import retrieve_documents
 from utils.doc_handler import process_documents
+from utils.ollama_client import get_ollama_client, OllamaClientEmbeddings
+from utils.llm_scheduler import get_scheduler, INTERACTIVE
+from utils.conversation_context import get_conversation_context
+from utils.model_manager import get_model_manager
+from utils.prompt_builder import assemble_prompt, get_rolling_summary, ANSWER_TOKENS
+from utils.llm_metrics import get_llm_metrics, start_metrics_server
+from utils.generation_governor import StreamGovernor, generation_options, think_params
+from utils.model_router import get_model_router, TASKS
 from sentence_transformers import CrossEncoder
 import torch
 import os
-import sqlite3
+import requests
 from dotenv import load_dotenv, find_dotenv
 import re
 from streamlit.components.v1 import html
 import time
+import logging
+import uuid
+try:
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+except ImportError:  # Older Streamlit without the runtime API
+    Runtime = get_script_run_ctx = None
 # Add the missing import
 from ui.ui_manager import UIManager
 from database.db_manager import DatabaseManager
@@ -22,12 +36,18 @@ torch.classes.__path__ = [os.path.join(torch.__path__[0], torch.classes.__file__
 load_dotenv(find_dotenv())  # Loads .env file contents into the application based on key-value pairs defined therein, making them accessible via 'os' module functions like os.getenv().
 
 OLLAMA_BASE_URL = os.getenv("OLLAMA_API_URL", "http://localhost:11434")
-OLLAMA_API_URL = f"{OLLAMA_BASE_URL}/api/generate"
 MODEL= os.getenv("MODEL", "deepseek-r1:7b")                                                      #Make sure you have it installed in ollama
 EMBEDDINGS_MODEL = "nomic-embed-text:latest"
 CROSS_ENCODER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
 
 device = "cuda" if torch.cuda.is_available() else "cpu"
+logger = logging.getLogger("app")
+logger.setLevel(logging.INFO)  # Generation timings are worth seeing by default
+
+metrics_port = start_metrics_server()  # 📈 Prometheus-style /metrics for every Ollama generation
+model_router = get_model_router(MODEL, OLLAMA_BASE_URL)  # 🧭 Per-task models (MODEL_HYDE, MODEL_INQUIRY, ...)
+model_manager = get_model_manager(OLLAMA_BASE_URL, MODEL, EMBEDDINGS_MODEL,
+                                  extra_models=[model_router.routes[task] for task in TASKS])  # 🔥 Preload models in the background so the first query isn't a cold start
 
 reranker = None                                                        # 🚀 Initialize Cross-Encoder (Reranker) at the global level 
 try:
@@ -163,6 +183,21 @@ if "context_step" not in st.session_state:
     st.session_state.context_step = 0
 if "waiting_for_next" not in st.session_state:
     st.session_state.waiting_for_next = False
+if "llm_session_id" not in st.session_state:
+    # Streamlit's own session id when available, so the scheduler can tell when the tab has gone
+    ctx = get_script_run_ctx() if get_script_run_ctx else None
+    st.session_state.llm_session_id = ctx.session_id if ctx else str(uuid.uuid4())
+
+def streamlit_session_alive(session_id):
+    """Whether a browser session is still connected; always true outside the Streamlit runtime"""
+    if Runtime is None or not Runtime.exists():
+        return True
+    return Runtime.instance().is_active_session(session_id)
+
+# Jobs started by the previous run of this script are orphaned: Streamlit stops a run without
+# closing its streams, so cancel them before this run queues new ones. Closed tabs are swept.
+get_scheduler().set_session_check(streamlit_session_alive)
+get_scheduler().cancel_session(st.session_state.llm_session_id)
 
 # Add to session state initialization
 if "learning_mode" not in st.session_state:
@@ -177,241 +212,16 @@ if "current_topic" not in st.session_state:
 # Check and create context
 DB_FILE = "context/context.db"
 
-def create_tables():
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS context (
-            id INTEGER PRIMARY KEY,
-            job TEXT NOT NULL,
-            name TEXT NOT NULL
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS characters (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            description TEXT
-        )
-    ''')
-    # Create the new director table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS director (
-            id INTEGER PRIMARY KEY,
-            goals TEXT NOT NULL,
-            character_names TEXT NOT NULL
-        )
-    ''')
-    # Add a new table for conversation history
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS conversation_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT NOT NULL,
-            role TEXT NOT NULL,
-            content TEXT NOT NULL
-        )
-    ''')
-    
-    # Add tables for instructions and context tracking
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS instructions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT NOT NULL,
-            instruction TEXT NOT NULL,
-            status TEXT DEFAULT 'pending'
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS knowledge_context (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            topic TEXT NOT NULL,
-            information TEXT NOT NULL,
-            confidence REAL DEFAULT 0.0,
-            last_updated TEXT
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS agents (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            character_id INTEGER,
-            capabilities TEXT,
-            status TEXT DEFAULT 'inactive'
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-# Add functions to track instructions and context
-def save_instruction(instruction):
-    """Save a user instruction to the database"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-    cursor.execute('INSERT INTO instructions (timestamp, instruction) VALUES (?, ?, ?)', 
-                   (timestamp, instruction))
-    instruction_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return instruction_id
-
-def save_knowledge_context(topic, information, confidence=0.7):
-    """Save learned information to the knowledge context database"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-    
-    # Check if topic exists
-    cursor.execute('SELECT id FROM knowledge_context WHERE topic = ?', (topic,))
-    result = cursor.fetchone()
-    
-    if result:
-        # Update existing topic if confidence is higher
-        cursor.execute('UPDATE knowledge_context SET information = ?, confidence = ?, last_updated = ? WHERE topic = ? AND confidence < ?', 
-                      (information, confidence, timestamp, topic, confidence))
-    else:
-        # Insert new topic
-        cursor.execute('INSERT INTO knowledge_context (topic, information, confidence, last_updated) VALUES (?, ?, ?, ?)', 
-                      (topic, information, confidence, timestamp))
-    
-    conn.commit()
-    conn.close()
-
-def get_relevant_knowledge(query, threshold=0.5):
-    """Get relevant knowledge from the context database"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT topic, information FROM knowledge_context WHERE confidence >= ?', (threshold,))
-    all_knowledge = cursor.fetchall()
-    conn.close()
-    
-    # Simple keyword matching for now
-    relevant_items = []
-    query_words = set(query.lower().split())
-    
-    for topic, information in all_knowledge:
-        topic_words = set(topic.lower().split())
-        if query_words.intersection(topic_words):
-            relevant_items.append((topic, information))
-    
-    return relevant_items
-
-def create_agent(name, character_id, capabilities="basic"):
-    """Create a new agent for a character"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO agents (name, character_id, capabilities, status) VALUES (?, ?, ?, ?)', 
-                   (name, character_id, capabilities, 'ready'))
-    agent_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return agent_id
+db_manager = DatabaseManager(DB_FILE, embeddings=OllamaClientEmbeddings(EMBEDDINGS_MODEL, OLLAMA_BASE_URL))  # Creates the tables; all DB access below goes through it
 
-# Add function to save prompt and response to history
-def save_to_conversation_history(role, content):
-    """Save a message to the conversation history database"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-    cursor.execute('INSERT INTO conversation_history (timestamp, role, content) VALUES (?, ?, ?)', (timestamp, role, content))
-    conn.commit()
-    conn.close()
+# 🗄️ Move history past the retention window into the compressed archive once per session
+if "history_archived" not in st.session_state:
+    st.session_state.history_archived = db_manager.archive_conversation_history()
+if "history_cursor" not in st.session_state:
+    # This session's messages get ids from here on; "Load older messages" pages from below it
+    st.session_state.history_cursor = db_manager.get_next_history_id()
 
-def get_context():
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT job, name FROM context WHERE id = 1')
-    context = cursor.fetchone()
-    conn.close()
-    return context
-
-def save_context(job, name):
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('INSERT OR REPLACE INTO context (id, job, name) VALUES (1, ?, ?)', (job, name))
-    conn.commit()
-    conn.close()
-
-def save_director_info(goals, character_names):
-    """Save director information to the database"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    # Convert character_names array to a JSON string if it's a list
-    if isinstance(character_names, list):
-        character_names = json.dumps(character_names)
-    cursor.execute('INSERT OR REPLACE INTO director (id, goals, character_names) VALUES (1, ?, ?)', 
-                  (goals, character_names))
-    conn.commit()
-    conn.close()
-
-def get_director_info():
-    """Get director information from the database"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT goals, character_names FROM director WHERE id = 1')
-    director = cursor.fetchone()
-    conn.close()
-    
-    if director:
-        goals, character_names = director
-        # Parse character_names back to a list if it's a JSON string
-        try:
-            character_names = json.loads(character_names)
-        except (json.JSONDecodeError, TypeError):
-            character_names = character_names.split(',') if character_names else []
-        return {"goals": goals, "character_names": character_names}
-    return None
-
-def get_characters():
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, name, description FROM characters')
-    characters = cursor.fetchall()
-    conn.close()
-    return characters
-
-def save_character(name, description=""):
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO characters (name, description) VALUES (?, ?)', (name, description))
-    conn.commit()
-    conn.close()
-
-def update_character(character_id, name, description=""):
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('UPDATE characters SET name = ?, description = ? WHERE id = ?', (name, description, character_id))
-    conn.commit()
-    conn.close()
-
-def delete_character(character_id):
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM characters WHERE id = ?', (character_id,))
-    conn.commit()
-    conn.close()
-
-def clear_context_db():
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # Clear director table first (now our primary source of truth)
-    try:
-        cursor.execute('DELETE FROM director')
-    except sqlite3.OperationalError:
-        # Table might not exist yet
-        pass
-        
-    # Clear legacy tables for backward compatibility
-    cursor.execute('DELETE FROM context')
-    cursor.execute('DELETE FROM characters')
-    
-    conn.commit()
-    conn.close()
-
-create_tables()
+CHAT_MESSAGE_WINDOW = int(os.getenv("CHAT_MESSAGE_WINDOW", "60"))  # Messages kept in session state
 
 def handle_initial_context():
     # Ensure context is always initialized
@@ -426,7 +236,7 @@ def handle_initial_context():
         st.session_state.messages = []  # Clear any existing messages
         greeting = "Hello! This looks like it's your first visit. Can you describe my purpose in assisting you?"
         st.session_state.messages.append({"role": "assistant", "content": greeting})
-        save_to_conversation_history("assistant", greeting)
+        db_manager.save_to_conversation_history("assistant", greeting)
         st.session_state.context_step = 1
         return  # Return after setting up the initial greeting
     
@@ -442,10 +252,7 @@ def handle_initial_context():
             st.session_state.context["goals"] = goals
             
             # Save to the director table immediately - store goals with empty characters list initially
-            save_director_info(goals, [])
-            
-            # Save the user's purpose response to conversation history
-            save_to_conversation_history("user", goals)
+            db_manager.save_director_info(goals, [])
             
             # Mark that we're waiting to show the next question
             st.session_state.waiting_for_next = True
@@ -453,7 +260,7 @@ def handle_initial_context():
             # Ask character question immediately instead of rerunning
             char_question = "What are the names of your FFXI characters? Enter ONLY the character names separated by commas (Example: Wondolio, Sintaroh, Timbearu)."
             st.session_state.messages.append({"role": "assistant", "content": char_question})
-            save_to_conversation_history("assistant", char_question)
+            db_manager.save_to_conversation_history("assistant", char_question)
             st.session_state.context_step = 2
             st.session_state.waiting_for_next = False
             
@@ -471,14 +278,11 @@ def handle_initial_context():
             # Get the last user message (character names)
             character_input = user_messages[-1]["content"]
             
-            # Save the user's prompt to conversation history
-            save_to_conversation_history("user", character_input)
-            
             # NO VALIDATION - Accept any input that's not empty
             if not character_input.strip():
                 message = "Please enter at least one character name. You can separate multiple names with commas."
                 st.session_state.messages.append({"role": "assistant", "content": message})
-                save_to_conversation_history("assistant", message)
+                db_manager.save_to_conversation_history("assistant", message)
                 return  # Stay on the same step, wait for proper names
                 
             # Process character names - very permissive approach
@@ -496,11 +300,13 @@ def handle_initial_context():
                 # Save to session state
                 st.session_state.context["character_names"] = character_names
                 
-                # Save to the director table - user goals and character names
-                save_director_info(st.session_state.context.get("goals", ""), character_names)
+                # Save the director record, the characters and an agent for each in one transaction
+                st.session_state.characters = db_manager.replace_director_and_characters(
+                    st.session_state.context.get("goals", ""), character_names
+                )
                 
                 # Also save to the old context system (can be removed later)
-                save_context(st.session_state.context.get("goals", ""), character_input)
+                db_manager.save_context(st.session_state.context.get("goals", ""), character_input)
                 
                 # Log successful saving for debugging
                 print(f"Saved character names to director table: {character_names}")
@@ -511,12 +317,7 @@ def handle_initial_context():
                 confirmation_message = f"Thank you! I'll keep track of your character(s): {char_list}. I'll help you manage and monitor their activity in the game. Your goal is: '{st.session_state.context.get('goals', '')}'. How can I get started?"
                 
                 st.session_state.messages.append({"role": "assistant", "content": confirmation_message})
-                save_to_conversation_history("assistant", confirmation_message)
-                
-                # Save the characters to the characters table for backward compatibility
-                for name in character_names:
-                    save_character(name)
-                st.session_state.characters = get_characters()
+                db_manager.save_to_conversation_history("assistant", confirmation_message)
                 
                 # Mark as complete
                 st.session_state.context_step = 4
@@ -527,7 +328,7 @@ def handle_initial_context():
                 # Empty input - ask again
                 message = "Please enter at least one character name. You can separate multiple names with commas."
                 st.session_state.messages.append({"role": "assistant", "content": message})
-                save_to_conversation_history("assistant", message)
+                db_manager.save_to_conversation_history("assistant", message)
     
     # Step 2b is removed - we now handle this directly in Step 2a above
 
@@ -537,7 +338,7 @@ def check_and_create_context():
         st.session_state.context = {}
     
     # Check for director info - primary source of truth
-    director_info = get_director_info()
+    director_info = db_manager.get_director_info()
     
     if director_info:
         # Director table has data, use it as the source of truth
@@ -545,15 +346,15 @@ def check_and_create_context():
         st.session_state.context["character_names"] = director_info["character_names"]
         
         # Load characters for backward compatibility
-        st.session_state.characters = get_characters()
+        st.session_state.characters = db_manager.get_characters()
         return True  # Context successfully loaded from director table
     else:
         # Also check legacy context table for backward compatibility
-        context = get_context()
+        context = db_manager.get_context()
         if context:
             st.session_state.context["job"] = context[0]
             st.session_state.context["name"] = context[1]
-            st.session_state.characters = get_characters()
+            st.session_state.characters = db_manager.get_characters()
             return True  # Context loaded from legacy table
     
     return False  # No context found in any table
@@ -672,7 +473,8 @@ with st.sidebar:
     
     if uploaded_files and not st.session_state.documents_loaded:
         with st.spinner("Processing documents..."):
-            process_documents(uploaded_files,reranker,EMBEDDINGS_MODEL, OLLAMA_BASE_URL)
+            process_documents(uploaded_files,reranker,EMBEDDINGS_MODEL, OLLAMA_BASE_URL,
+                              MODEL if st.session_state.get("enable_community_summaries") else None)
             st.success("Documents processed!")
     
     st.markdown("---")
@@ -682,12 +484,21 @@ with st.sidebar:
     st.session_state.enable_hyde = st.checkbox("Enable HyDE", value=True)
     st.session_state.enable_reranking = st.checkbox("Enable Neural Reranking", value=True)
     st.session_state.enable_graph_rag = st.checkbox("Enable GraphRAG", value=True)
+    st.session_state.graph_rag_mode = st.selectbox("GraphRAG Mode", ["Multi-hop", "PageRank", "Community"],
+                                                   help="PageRank ranks chunks by personalized PageRank; Community answers broad questions from precomputed graph communities")
+    st.session_state.enable_community_summaries = st.checkbox("Summarize Graph Communities", value=False,
+                                                              help="Generate a cached LLM summary per community when documents are processed")
     st.session_state.temperature = st.slider("Temperature", 0.0, 1.0, 0.3, 0.05)
     st.session_state.max_contexts = st.slider("Max Contexts", 1, 5, 3)
     
     if st.button("Clear Chat History"):
         st.session_state.messages = []
-        clear_context_db()  # Clear the context database
+        st.session_state.ollama_contexts = {}
+        st.session_state.pop("conversation_summary", None)
+        st.session_state.pop("older_messages", None)
+        st.session_state.pop("visible_messages", None)
+        st.session_state.history_cursor = -1  # Don't page the cleared conversation back in
+        db_manager.clear_context_db()  # Clear the context database
         st.session_state.context = {}
         st.session_state.context_step = 0
         # Show toast using the proper method
@@ -722,27 +533,277 @@ with st.sidebar:
         st.session_state.current_topic = None
         show_toast("Reset all learning progress!")
 
+    st.markdown("---")
+    with st.expander("🔥 Models", expanded=not model_manager.ready):
+        for name, info in model_manager.snapshot().items():
+            label = {"ready": "✅", "loading": "⏳", "error": "❌"}.get(info["state"], "…")
+            details = f" (loaded in {info['load_s']}s, last ping {info['last_ping']})" if info["state"] == "ready" else ""
+            st.write(f"{label} `{name}` {info['state']}{details}")
+            if info["error"]:
+                st.caption(info["error"])
+    with st.expander("📊 LLM Queue"):
+        st.json(get_scheduler().metrics())
+    with st.expander("🧭 Model Routes"):
+        st.json({"routes": model_router.routes, "stats": model_router.snapshot()})
+    with st.expander("📈 LLM Metrics"):
+        if metrics_port:
+            st.caption(f"Prometheus endpoint: http://127.0.0.1:{metrics_port}/metrics")
+        st.json(get_llm_metrics().snapshot())
+
 # Main content area with tabbed interface
 ui_manager = UIManager()
-db_manager = DatabaseManager(DB_FILE)
 
 # Set up the tabbed interface
 message_container, dashboard_tab = ui_manager.display_main_interface(db_manager)
 
+def trim_session_messages():
+    """Drop the oldest messages outside the window, whether or not the rolling summary covers them yet
+
+    They move to the view-only ``older_messages`` list, so the prompt history and the
+    summary bookkeeping stay bounded however long the chat runs, and "Load older
+    messages" still shows them. The cap doesn't wait for the summary, whose
+    background job can fail or be cancelled.
+    """
+    summary = get_rolling_summary(st.session_state)
+    excess = len(st.session_state.messages) - CHAT_MESSAGE_WINDOW
+    if excess > 0:
+        if excess > summary.covered:
+            logger.info(f"Trimming {excess - summary.covered} chat message(s) not yet in the rolling summary")
+        # Stored history is paged in behind these, so they stay in the view between it and the window
+        st.session_state.older_messages = (st.session_state.get("older_messages", [])
+                                           + st.session_state.messages[:excess])
+        del st.session_state.messages[:excess]
+        summary.discard(excess)
+
 # Display messages in the chat tab
-ui_manager.display_messages(message_container)
+trim_session_messages()
+ui_manager.display_messages(message_container, db_manager)
 
 # Display the dashboard in its tab
 ui_manager.display_dashboard(dashboard_tab)
 
+# Add function to determine if we have enough information on a topic
+def has_sufficient_information(topic):
+    """Check if we have gathered enough information about a topic"""
+    if topic not in st.session_state.conversation_topics:
+        return False
+    
+    # If we've asked at least 3 follow-up questions on this topic
+    if st.session_state.conversation_topics[topic].get('inquiry_count', 0) >= 3:
+        return True
+    
+    # Or if we explicitly marked it as understood
+    return st.session_state.conversation_topics[topic].get('understood', False)
+
+# Function to extract topics from user messages
+def extract_topic(message):
+    """Simple topic extraction - can be extended with NLP"""
+    # For now just use first few words as topic identifier
+    words = message.split()
+    if len(words) > 3:
+        return " ".join(words[:3]).lower()
+    return message.lower()
+
+# Stable per-mode instructions, sent as Ollama's system prompt when a conversation context starts
+MODE_INSTRUCTIONS = {
+    "inquiry": """You are in LEARNING MODE. You know NOTHING about the topic.
+        
+        Your ONLY goal is to understand by asking clarifying questions.
+        
+        DO NOT provide information. DO NOT pretend to know things.
+        DO NOT apologize for not knowing.
+        
+        ONLY RESPOND WITH:
+        1. "I don't know" if you truly can't understand the message
+        2. A short, focused follow-up question to understand better
+        3. "Yes" or "No" if it's a yes/no question and you're certain
+        4. "Understood." if it's a command or instruction
+        
+        Keep your response under 30 words. Be humble and curious.""",
+    "summary": """You are in SUMMARY MODE. Summarize your understanding.
+        
+        Start with "I understand that..." and keep it concise (maximum 3 sentences).
+        
+        After this summary, ask if your understanding is correct.""",
+    "contextual": """You are in CONTEXTUAL MODE.
+        
+        Respond ONLY with:
+        1. Facts directly from the context information from database
+        2. "I don't know" if the context doesn't contain relevant information
+        3. A clarifying question if you need more specific information
+        
+        Keep your response under 50 words. Don't fabricate information."""
+}
+
+# Modify the get_data_from_db_or_model function to implement the learning-focused approach
+def get_data_from_db_or_model(prompt, chat_history):
+    """Yield the assistant's reply token by token and persist the full text once it is complete
+
+    ``chat_history`` is the list of earlier chat messages; it is packed into the
+    prompt only as far as the token budget allows.
+    """
+    # First check if this is a question about goals or characters
+    is_about_goals = re.search(r"goal|purpose|assist", prompt, re.IGNORECASE)
+    is_about_characters = re.search(r"character|party|member", prompt, re.IGNORECASE)
+    
+    # Default response type is learning/questioning
+    response_type = "inquiry"
+    
+    # Context from database when needed
+    db_context = ""
+    if is_about_goals:
+        director_info = db_manager.get_director_info()
+        if director_info and "goals" in director_info:
+            db_context = f"USER GOALS: {director_info['goals']}\n"
+            response_type = "contextual"
+    
+    if is_about_characters:
+        director_info = db_manager.get_director_info()
+        if director_info and "character_names" in director_info:
+            char_names = ", ".join(director_info["character_names"])
+            db_context = f"CHARACTERS: {char_names}\n"
+            response_type = "contextual"
+    
+    # Extract topic for tracking conversation state
+    topic = extract_topic(prompt)
+    
+    # Update topic tracking
+    if topic not in st.session_state.conversation_topics:
+        st.session_state.conversation_topics[topic] = {
+            'inquiry_count': 0,
+            'understood': False,
+            'last_question': None
+        }
+    
+    st.session_state.current_topic = topic
+    
+    # Check if we need more information or can provide a summary
+    if has_sufficient_information(topic):
+        response_type = "summary"
+    else:
+        # Increment inquiry count for this topic
+        st.session_state.conversation_topics[topic]['inquiry_count'] += 1
+    
+    # If it's a simple command or instruction, acknowledge it
+    if prompt.strip().endswith("?") == False and len(prompt.split()) < 8:
+        db_manager.save_to_conversation_history("assistant", "Understood.")
+        yield "Understood."
+        return
+    
+    # Mode instructions are a stable system prompt; only the turn itself changes between calls
+    if response_type == "inquiry":
+        turn_prompt = f"User's message: {prompt}"
+    elif response_type == "summary":
+        turn_prompt = f"""Based on our conversation about "{topic}", provide a brief summary of your understanding."""
+    else:  # contextual - for character/goal specific questions, db_context is added by the assembler
+        turn_prompt = f"User's message: {prompt}"
+    
+    # Reuse this session's Ollama context so earlier turns aren't re-evaluated
+    model = model_router.model_for(response_type)
+    conversation = get_conversation_context(st.session_state, response_type, MODE_INSTRUCTIONS[response_type],
+                                            model=model, chat_history=chat_history)
+    
+    # Pack the turn into what's left of num_ctx; older turns live in the rolling summary
+    client = get_ollama_client(OLLAMA_BASE_URL)
+    summary = get_rolling_summary(st.session_state)
+    summary.refresh(chat_history, client, MODEL)
+    if conversation.active:
+        history, summary_text = [], ""  # The reused context already holds the conversation
+    else:
+        history, summary_text = summary.recent(chat_history), summary.text
+    turn_prompt, budget_report = assemble_prompt(
+        turn_prompt,
+        conversation.prompt_budget(ANSWER_TOKENS),
+        db_context=db_context if response_type == "contextual" else "",
+        history=history,
+        summary=summary_text
+    )
+    if budget_report["truncated"] or budget_report["dropped"]:
+        logger.info(f"Prompt budget: {budget_report}")
+    
+    # Stream the visible answer to the caller as it arrives; <think> tokens are counted, not shown
+    full_response = ""
+    started = time.perf_counter()
+    first_token_at = None
+    governor = StreamGovernor(response_type)
+    try:
+        job = get_scheduler().stream_generate(
+            client,
+            turn_prompt,
+            model,
+            options=generation_options(
+                response_type,
+                temperature=0.2,  # Lower temperature for more consistent responses
+                num_ctx=conversation.num_ctx
+            ),
+            priority=INTERACTIVE,
+            session_id=st.session_state.llm_session_id,
+            source="chat",
+            **think_params(),
+            **conversation.request_params()
+        )
+        stream = job.stream()
+        for data in stream:
+            if data.get("done", False):
+                conversation.update(data)
+                logger.info(f"Prompt evaluated {data.get('prompt_eval_count', 0)} tokens "
+                            f"(context turn {conversation.turns}, {response_type} mode)")
+            token = governor.feed_chunk(data)
+            if token:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    logger.info(f"Time to first visible token: {first_token_at - started:.2f}s "
+                                f"(queue wait {job.queue_wait:.2f}s, {response_type} mode)")
+                full_response += token
+                yield token
+            if governor.done:
+                # The answer is complete; cancelling closes the stream so Ollama stops generating
+                stream.close()
+                conversation.reset()  # A cut-off generation returns no context to reuse
+                logger.info(f"Stopped early after {governor.answer_tokens} answer tokens ({response_type} mode)")
+                break
+        
+        tail = governor.finish()
+        if tail:
+            full_response += tail
+            yield tail
+        answered = bool(full_response.strip())
+        if not answered:
+            full_response = "I don't know. Can you explain further?"  # num_predict ran out while thinking
+            yield full_response
+        conversation.record_reply(full_response)
+        model_router.record(response_type, model, time.perf_counter() - started, quality=1.0 if answered else 0.0)
+        get_llm_metrics().observe("thinking_tokens", "chat", governor.thinking_tokens)
+        logger.info(f"Thinking tokens: {governor.thinking_tokens}, answer tokens: {governor.answer_tokens}")
+        
+        # If response indicates understanding, mark topic as understood
+        if "i understand" in full_response.lower() or "understood" in full_response.lower():
+            if st.session_state.current_topic:
+                st.session_state.conversation_topics[st.session_state.current_topic]['understood'] = True
+        
+        # Save the complete response to conversation history once the stream has ended
+        logger.info(f"Generation finished in {time.perf_counter() - started:.2f}s ({len(full_response)} chars)")
+        db_manager.save_to_conversation_history("assistant", full_response)
+    except Exception as e:
+        model_router.record(response_type, model, time.perf_counter() - started, ok=False)
+        if isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code == 404:
+            model_router.mark_missing(model)  # Fall back to MODEL from the next turn on
+        error_message = f"I don't know. Can you explain further?"
+        db_manager.save_to_conversation_history("assistant", error_message)
+        st.error(f"Generation error: {str(e)}")
+        yield error_message
+
 # Chat input handling
 if prompt := st.chat_input("Ask about your documents..."):
+    # A new message supersedes anything this session still has queued or generating
+    get_scheduler().cancel_session(st.session_state.llm_session_id)
+    
     # Display the user's input
     with st.chat_message("user"):
         st.markdown(prompt)
     
     # Save every user prompt to conversation history immediately
-    save_to_conversation_history("user", prompt)
+    db_manager.save_to_conversation_history("user", prompt)
     
     # Check if we're in the initial context flow or normal flow
     if not has_context or st.session_state.context_step in [1, 2]:
@@ -765,8 +826,8 @@ if prompt := st.chat_input("Ask about your documents..."):
         
         if update_pattern.search(prompt):
             # Get existing characters
-            characters = get_characters()
-            director_info = get_director_info()
+            characters = db_manager.get_characters()
+            director_info = db_manager.get_director_info()
             
             # Get character names from director table for display
             if director_info and "character_names" in director_info:
@@ -776,6 +837,18 @@ if prompt := st.chat_input("Ask about your documents..."):
                 character_list = ", ".join([f"{char[0]}: {char[1]}" for char in characters])
                 message = f"Here are your current characters:\n{character_list}\n\nTo update all characters at once, reply with: 'set characters to: Name1, Name2, Name3'"
             
+            st.session_state.messages.append({"role": "assistant", "content": message})
+            with st.chat_message("assistant"):
+                st.markdown(message)
+            message_response = message
+        elif re.match(r"set characters to:\s*(.+)", prompt, re.IGNORECASE):
+            names = [name.strip() for name in re.match(r"set characters to:\s*(.+)", prompt, re.IGNORECASE).group(1).split(",")]
+            director_info = db_manager.get_director_info()
+            st.session_state.characters = db_manager.replace_director_and_characters(
+                director_info["goals"] if director_info else st.session_state.context.get("goals", ""), names
+            )
+            st.session_state.context["character_names"] = [char[1] for char in st.session_state.characters]
+            message = f"I've updated your characters to: {', '.join(st.session_state.context['character_names'])}."
             st.session_state.messages.append({"role": "assistant", "content": message})
             with st.chat_message("assistant"):
                 st.markdown(message)
@@ -788,10 +861,8 @@ if prompt := st.chat_input("Ask about your documents..."):
             st.session_state.adding_character = True
             message_response = message
         elif hasattr(st.session_state, 'adding_character') and st.session_state.adding_character:
-            st.session_state.messages.append({"role": "user", "content": prompt})
-            with st.chat_message("user"):
-                st.markdown(prompt)
-            save_character(prompt.strip())
+            character_ids = db_manager.save_characters([prompt.strip()])
+            db_manager.create_agents([(character_ids[0], prompt.strip())])
             message = f"I've added {prompt.strip()} to your characters!"
             st.session_state.messages.append({"role": "assistant", "content": message})
             with st.chat_message("assistant"):
@@ -799,25 +870,19 @@ if prompt := st.chat_input("Ask about your documents..."):
             st.session_state.adding_character = False
             message_response = message
         elif re.match(r"update character (\d+) to (.+)", prompt, re.IGNORECASE):
-            st.session_state.messages.append({"role": "user", "content": prompt})
-            with st.chat_message("user"):
-                st.markdown(prompt)
             match = re.match(r"update character (\d+) to (.+)", prompt, re.IGNORECASE)
             char_id = int(match.group(1))
             new_name = match.group(2).strip()
-            update_character(char_id, new_name)
+            db_manager.update_character(char_id, new_name)
             message = f"I've updated character {char_id} to {new_name}."
             st.session_state.messages.append({"role": "assistant", "content": message})
             with st.chat_message("assistant"):
                 st.markdown(message)
             message_response = message
         elif re.match(r"delete character (\d+)", prompt, re.IGNORECASE):
-            st.session_state.messages.append({"role": "user", "content": prompt})
-            with st.chat_message("user"):
-                st.markdown(prompt)
             match = re.match(r"delete character (\d+)", prompt, re.IGNORECASE)
             char_id = int(match.group(1))
-            delete_character(char_id)
+            db_manager.delete_character(char_id)
             message = f"I've deleted character {char_id}."
             st.session_state.messages.append({"role": "assistant", "content": message})
             with st.chat_message("assistant"):
@@ -828,29 +893,22 @@ if prompt := st.chat_input("Ask about your documents..."):
                 # Save the provided purpose context
                 job = prompt
                 st.session_state.context["job"] = job
-                save_context(st.session_state.context["job"], st.session_state.context.get("name", ""))
+                db_manager.save_context(st.session_state.context["job"], st.session_state.context.get("name", ""))
                 message = f"Thank you! I've saved my purpose as {job}."
                 st.session_state.messages.append({"role": "assistant", "content": message})
-                save_to_conversation_history("assistant", message)
+                db_manager.save_to_conversation_history("assistant", message)
                 st.session_state.context_step = 0  # Reset the context step
             else:
-                chat_history = "\n".join([msg["content"] for msg in st.session_state.messages[-5:]])  # Last 5 messages
-                st.session_state.messages.append({"role": "user", "content": prompt})
-                with st.chat_message("user"):
-                    st.markdown(prompt)
+                chat_history = st.session_state.messages[:-1]  # Everything before this prompt; budgeted when the prompt is built
                 
-                # Get data from DB or model
-                response = get_data_from_db_or_model(prompt, chat_history)
-                st.session_state.messages.append({"role": "assistant", "content": response})
+                # Stream data from DB or model into the assistant message as it is generated
                 with st.chat_message("assistant"):
-                    st.markdown(response)
-                # When adding assistant's response, save it to conversation history too
-                if "assistant" in locals() and response:
-                    save_to_conversation_history("assistant", response)
+                    response = st.write_stream(get_data_from_db_or_model(prompt, chat_history))
+                st.session_state.messages.append({"role": "assistant", "content": response})
 
         # Save assistant's response to conversation history for command-based responses
         if message_response:
-            save_to_conversation_history("assistant", message_response)
+            db_manager.save_to_conversation_history("assistant", message_response)
 
     # Keep the character status update command handling for future use
     update_status_pattern = re.compile(r"update status for ([a-zA-Z]+):(.*)", re.IGNORECASE)
@@ -879,171 +937,8 @@ if prompt := st.chat_input("Ask about your documents..."):
         
         message = f"Updated status for {char_name}!"
         st.session_state.messages.append({"role": "assistant", "content": message})
+        db_manager.save_to_conversation_history("assistant", message)
         with st.chat_message("assistant"):
             st.markdown(message)
         # Show a toast notification instead of rerunning since we don't have the sidebar to update
         show_toast(f"Status updated for {char_name}")
-
-# Add function to determine if we have enough information on a topic
-def has_sufficient_information(topic):
-    """Check if we have gathered enough information about a topic"""
-    if topic not in st.session_state.conversation_topics:
-        return False
-    
-    # If we've asked at least 3 follow-up questions on this topic
-    if st.session_state.conversation_topics[topic].get('inquiry_count', 0) >= 3:
-        return True
-    
-    # Or if we explicitly marked it as understood
-    return st.session_state.conversation_topics[topic].get('understood', False)
-
-# Function to extract topics from user messages
-def extract_topic(message):
-    """Simple topic extraction - can be extended with NLP"""
-    # For now just use first few words as topic identifier
-    words = message.split()
-    if len(words) > 3:
-        return " ".join(words[:3]).lower()
-    return message.lower()
-
-# Modify the get_data_from_db_or_model function to implement the learning-focused approach
-def get_data_from_db_or_model(prompt, chat_history):
-    # First check if this is a question about goals or characters
-    is_about_goals = re.search(r"goal|purpose|assist", prompt, re.IGNORECASE)
-    is_about_characters = re.search(r"character|party|member", prompt, re.IGNORECASE)
-    
-    # Default response type is learning/questioning
-    response_type = "inquiry"
-    
-    # Context from database when needed
-    db_context = ""
-    if is_about_goals:
-        director_info = get_director_info()
-        if director_info and "goals" in director_info:
-            db_context = f"USER GOALS: {director_info['goals']}\n"
-            response_type = "contextual"
-    
-    if is_about_characters:
-        director_info = get_director_info()
-        if director_info and "character_names" in director_info:
-            char_names = ", ".join(director_info["character_names"])
-            db_context = f"CHARACTERS: {char_names}\n"
-            response_type = "contextual"
-    
-    # Extract topic for tracking conversation state
-    topic = extract_topic(prompt)
-    
-    # Update topic tracking
-    if topic not in st.session_state.conversation_topics:
-        st.session_state.conversation_topics[topic] = {
-            'inquiry_count': 0,
-            'understood': False,
-            'last_question': None
-        }
-    
-    st.session_state.current_topic = topic
-    
-    # Check if we need more information or can provide a summary
-    if has_sufficient_information(topic):
-        response_type = "summary"
-    else:
-        # Increment inquiry count for this topic
-        st.session_state.conversation_topics[topic]['inquiry_count'] += 1
-    
-    # If it's a simple command or instruction, acknowledge it
-    if prompt.strip().endswith("?") == False and len(prompt.split()) < 8:
-        return "Understood."
-    
-    # Custom system prompts based on response type
-    if response_type == "inquiry":
-        system_prompt = f"""You are in LEARNING MODE. You know NOTHING about the topic.
-        
-        Your ONLY goal is to understand by asking clarifying questions.
-        
-        Previous conversation:
-        {chat_history}
-        
-        User's message: {prompt}
-        
-        DO NOT provide information. DO NOT pretend to know things.
-        DO NOT apologize for not knowing.
-        
-        ONLY RESPOND WITH:
-        1. "I don't know" if you truly can't understand the message
-        2. A short, focused follow-up question to understand better
-        3. "Yes" or "No" if it's a yes/no question and you're certain
-        4. "Understood." if it's a command or instruction
-        
-        Keep your response under 30 words. Be humble and curious."""
-    
-    elif response_type == "summary":
-        system_prompt = f"""You are in SUMMARY MODE. Summarize your understanding.
-        
-        Previous conversation:
-        {chat_history}
-        
-        Based on our conversation about "{topic}", provide a brief summary of your understanding.
-        
-        Start with "I understand that..." and keep it concise (maximum 3 sentences).
-        
-        After this summary, ask if your understanding is correct."""
-    
-    else:  # contextual - for character/goal specific questions
-        system_prompt = f"""You are in CONTEXTUAL MODE.
-        
-        Context information from database:
-        {db_context}
-        
-        Previous conversation:
-        {chat_history}
-        
-        User's message: {prompt}
-        
-        Respond ONLY with:
-        1. Facts directly from the context above
-        2. "I don't know" if the context doesn't contain relevant information
-        3. A clarifying question if you need more specific information
-        
-        Keep your response under 50 words. Don't fabricate information."""
-    
-    # Stream response
-    response = requests.post(
-        OLLAMA_API_URL,
-        json={
-            "model": MODEL,
-            "prompt": system_prompt,
-            "stream": True,
-            "options": {
-                "temperature": 0.2,  # Lower temperature for more consistent responses
-                "num_ctx": 4096
-            }
-        },
-        stream=True
-    )
-    
-    full_response = ""
-    try:
-        for line in response.iter_lines():
-            if line:
-                data = json.loads(line.decode())
-                token = data.get("response", "")
-                full_response += token
-                # Stop if we detect the end token
-                if data.get("done", False):
-                    break
-        
-        # If response indicates understanding, mark topic as understood
-        if "i understand" in full_response.lower() or "understood" in full_response.lower():
-            if st.session_state.current_topic:
-                st.session_state.conversation_topics[st.session_state.current_topic]['understood'] = True
-        
-        # Save the response to conversation history
-        save_to_conversation_history("assistant", full_response)
-        
-        return full_response
-    except Exception as e:
-        error_message = f"I don't know. Can you explain further?"
-        save_to_conversation_history("assistant", error_message)
-        st.error(f"Generation error: {str(e)}")
-        return error_message
-
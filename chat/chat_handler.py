@@ -16,10 +16,20 @@ class ChatHandler:
         self.model = model
         self.agents = {}  # Store character agents
     
+    def register_agents(self):
+        """Register an agent for every known character in one transaction and load them"""
+        characters = self.db_manager.get_characters()
+        agent_ids = self.db_manager.create_agents(characters)
+        for character_id, name, _ in characters:
+            if name not in self.agents and character_id in agent_ids:
+                self.agents[name] = FFXIAgent(agent_id=agent_ids[character_id], db_path=self.db_manager.db_path)
+    
     def get_or_create_agent(self, character_name):
         """Get an existing agent or create a new one for a character"""
         if character_name not in self.agents:
-            self.agents[character_name] = FFXIAgent(character_name=character_name)
+            self.register_agents()
+        if character_name not in self.agents:
+            self.agents[character_name] = FFXIAgent(character_name=character_name, db_path=self.db_manager.db_path)
         return self.agents[character_name]
     
     def handle_command(self, prompt):
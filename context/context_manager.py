@@ -147,9 +147,9 @@ class ContextManager:
                     st.session_state.messages.append({"role": "assistant", "content": confirmation_message})
                     self.db_manager.save_to_conversation_history("assistant", confirmation_message)
                     
-                    # Save characters for backward compatibility
-                    for name in character_names:
-                        self.db_manager.save_character(name)
+                    # Save characters for backward compatibility, each with its agent
+                    character_ids = self.db_manager.save_characters(character_names)
+                    self.db_manager.create_agents(list(zip(character_ids, character_names)))
                     st.session_state.characters = self.db_manager.get_characters()
                     
                     # Mark as complete
@@ -1,35 +1,24 @@
 import os
-import sqlite3
+from database.connection import get_connection, transaction
 
 DB_FILE = "context/context.db"
 
 def create_context_table():
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS context (
-            id INTEGER PRIMARY KEY,
-            job TEXT NOT NULL,
-            name TEXT NOT NULL
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    with transaction(DB_FILE) as cursor:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS context (
+                id INTEGER PRIMARY KEY,
+                job TEXT NOT NULL,
+                name TEXT NOT NULL
+            )
+        ''')
 
 def get_context():
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT job, name FROM context WHERE id = 1')
-    context = cursor.fetchone()
-    conn.close()
-    return context
+    return get_connection(DB_FILE).execute('SELECT job, name FROM context WHERE id = 1').fetchone()
 
 def save_context(job, name):
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('INSERT OR REPLACE INTO context (id, job, name) VALUES (1, ?, ?)', (job, name))
-    conn.commit()
-    conn.close()
+    with transaction(DB_FILE) as cursor:
+        cursor.execute('INSERT OR REPLACE INTO context (id, job, name) VALUES (1, ?, ?)', (job, name))
 
 def initial_greeting():
     create_context_table()
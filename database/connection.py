@@ -0,0 +1,72 @@
+"""
+SQLite connection manager - one tuned, long-lived connection per thread and database file
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DEFAULT_DB_PATH = "context/context.db"
+BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+STATEMENT_CACHE_SIZE = 256  # Prepared statements kept per connection, keyed by SQL text
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",  # Readers don't block the writer and commits append instead of rewriting pages
+    "PRAGMA synchronous=NORMAL",  # Safe with WAL; fsync only at checkpoints instead of on every commit
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}",
+    "PRAGMA cache_size=-16000",  # 16 MB page cache
+    "PRAGMA mmap_size=268435456",  # Map up to 256 MB of the file instead of read() calls
+    "PRAGMA temp_store=MEMORY",
+)
+
+_local = threading.local()
+
+
+def get_connection(db_path=DEFAULT_DB_PATH):
+    """Return this thread's connection to ``db_path``, opening and tuning it on first use
+
+    Connections can't be shared across threads, so each thread keeps one connection
+    per database file for its lifetime. Streamlit starts a new script thread on every
+    rerun, so in the app a connection (with its page and statement caches) lasts one
+    rerun, not one session; long-lived threads such as the write-behind writer and
+    the vitals rollup keep theirs. Within that lifetime, reuse keeps the page cache
+    warm and lets sqlite3 reuse prepared statements instead of re-parsing the same
+    SQL on every call.
+    """
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    key = os.path.abspath(db_path)
+    conn = connections.get(key)
+    if conn is None:
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_MS / 1000, cached_statements=STATEMENT_CACHE_SIZE)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        connections[key] = conn
+    return conn
+
+
+@contextmanager
+def transaction(db_path=DEFAULT_DB_PATH):
+    """Yield a cursor inside a transaction that commits on success and rolls back on error"""
+    conn = get_connection(db_path)
+    cursor = conn.cursor()
+    try:
+        yield cursor
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def close_connection(db_path=DEFAULT_DB_PATH):
+    """Close this thread's connection to ``db_path`` if it has one"""
+    connections = getattr(_local, "connections", {})
+    conn = connections.pop(os.path.abspath(db_path), None)
+    if conn is not None:
+        conn.close()
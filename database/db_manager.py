@@ -1,141 +1,341 @@
+import os
+import re
+import zlib
 import sqlite3
 import json
 import time
-import os
+import logging
+
+from database.connection import get_connection, transaction
+from database.write_behind import get_write_behind
+from database.read_cache import get_read_cache
+from database.knowledge_index import get_knowledge_index, encode_embedding, decode_embedding
+
+logger = logging.getLogger(__name__)
+
+KNOWLEDGE_LIMIT = 10  # Most relevant knowledge rows returned per query
+TOPIC_WEIGHT = 10.0  # BM25 weight of a topic match relative to a match in the information text
+HISTORY_PAGE_SIZE = 20  # Messages per page of conversation history
+HISTORY_RETAIN_ROWS = int(os.getenv("HISTORY_RETAIN_ROWS", "2000"))  # Newest messages never archived
+HISTORY_RETAIN_DAYS = float(os.getenv("HISTORY_RETAIN_DAYS", "30"))  # Messages younger than this are never archived
+ARCHIVE_CHUNK = 500  # Messages per compressed archive row
+KNOWLEDGE_MIN_SIMILARITY = float(os.getenv("KNOWLEDGE_MIN_SIMILARITY", "0.5"))  # Cosine similarity for a semantic hit
+EMBED_BATCH = 32  # Knowledge rows embedded per request when backfilling
+KNOWLEDGE_BACKFILL_INTERVAL = float(os.getenv("KNOWLEDGE_BACKFILL_INTERVAL", "300"))  # Seconds between backfill checks
+# Left out of keyword matching so "for", "the", ... don't match every fact
+STOPWORDS = frozenset(
+    "a an and are as at be but by can do does for from how i in is it me my of on or so that the "
+    "to was what when where which who why will with you your".split()
+)
+
+# Schema migrations, applied in order; PRAGMA user_version records how many have run
+MIGRATIONS = [
+    # 1: indexes for the hot lookups, UNIQUE topic/agent-per-character so writes can upsert
+    [
+        # Keep the most confident (then newest) row per topic before making topics unique
+        '''DELETE FROM knowledge_context WHERE EXISTS (
+            SELECT 1 FROM knowledge_context k
+            WHERE k.topic = knowledge_context.topic
+              AND (k.confidence > knowledge_context.confidence
+                   OR (k.confidence = knowledge_context.confidence AND k.id > knowledge_context.id))
+        )''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_knowledge_context_topic ON knowledge_context(topic)',
+        # Keep the first agent registered for each character
+        '''DELETE FROM agents WHERE character_id IS NOT NULL AND id > (
+            SELECT MIN(a.id) FROM agents a WHERE a.character_id = agents.character_id
+        )''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_agents_character_id ON agents(character_id)',
+        'CREATE INDEX IF NOT EXISTS idx_characters_name ON characters(name)',
+        'CREATE INDEX IF NOT EXISTS idx_conversation_history_timestamp ON conversation_history(timestamp)',
+    ],
+    # 2: archive for conversation history past the retention window, zlib-compressed JSON per chunk
+    [
+        '''CREATE TABLE IF NOT EXISTS conversation_archive (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            first_id INTEGER NOT NULL,
+            last_id INTEGER NOT NULL,
+            first_timestamp TEXT NOT NULL,
+            last_timestamp TEXT NOT NULL,
+            row_count INTEGER NOT NULL,
+            payload BLOB NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_conversation_archive_last_id ON conversation_archive(last_id)',
+    ],
+    # 3: knowledge embeddings (float16 BLOB) and the model that produced them
+    [
+        'ALTER TABLE knowledge_context ADD COLUMN embedding BLOB',
+        'ALTER TABLE knowledge_context ADD COLUMN embedding_model TEXT',
+        # Recreated by create_knowledge_index to fire on topic/information only, not embedding updates
+        'DROP TRIGGER IF EXISTS knowledge_fts_update',
+    ],
+]
 
 class DatabaseManager:
     """Class to handle all database operations"""
     
-    def __init__(self, db_path="context/context.db"):
-        """Initialize the database manager"""
-        self.db_path = db_path
-        # Create directory if it doesn't exist
-        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    def __init__(self, db_path="context/context.db", embeddings=None):
+        """Initialize the database manager
+        
+        ``embeddings`` (``embed_documents``/``embed_query``, e.g. OllamaClientEmbeddings)
+        turns on semantic knowledge lookups; without it they are keyword-only.
+        """
+        self.db_path = db_path  # Connections are opened per thread by database.connection and reused
+        self.embeddings = embeddings
+        self.embedding_model = None
+        if embeddings is not None:
+            self.embedding_model = getattr(embeddings, "model", None) or type(embeddings).__name__
         self.create_tables()
+        self.fts_enabled = self.create_knowledge_index()
+        self.writer = get_write_behind(db_path)  # History and instruction inserts; None when WRITE_BEHIND=0
+        self.cache = get_read_cache(db_path)  # Director, characters and context rows, dropped on every write
     
     def create_tables(self):
         """Create all necessary tables if they don't exist"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with transaction(self.db_path) as cursor:
+            # Context table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS context (
+                    id INTEGER PRIMARY KEY,
+                    job TEXT NOT NULL,
+                    name TEXT NOT NULL
+                )
+            ''')
         
-        # Context table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS context (
-                id INTEGER PRIMARY KEY,
-                job TEXT NOT NULL,
-                name TEXT NOT NULL
-            )
-        ''')
+            # Characters table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS characters (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    description TEXT
+                )
+            ''')
         
-        # Characters table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS characters (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                description TEXT
-            )
-        ''')
+            # Director table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS director (
+                    id INTEGER PRIMARY KEY,
+                    goals TEXT NOT NULL,
+                    character_names TEXT NOT NULL
+                )
+            ''')
         
-        # Director table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS director (
-                id INTEGER PRIMARY KEY,
-                goals TEXT NOT NULL,
-                character_names TEXT NOT NULL
-            )
-        ''')
+            # Conversation history table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS conversation_history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp TEXT NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL
+                )
+            ''')
         
-        # Conversation history table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS conversation_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
-                role TEXT NOT NULL,
-                content TEXT NOT NULL
-            )
-        ''')
+            # Instructions table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS instructions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp TEXT NOT NULL,
+                    instruction TEXT NOT NULL,
+                    status TEXT DEFAULT 'pending'
+                )
+            ''')
         
-        # Instructions table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS instructions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
-                instruction TEXT NOT NULL,
-                status TEXT DEFAULT 'pending'
-            )
-        ''')
+            # Knowledge context table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS knowledge_context (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    topic TEXT NOT NULL,
+                    information TEXT NOT NULL,
+                    confidence REAL DEFAULT 0.0,
+                    last_updated TEXT
+                )
+            ''')
         
-        # Knowledge context table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS knowledge_context (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                topic TEXT NOT NULL,
-                information TEXT NOT NULL,
-                confidence REAL DEFAULT 0.0,
-                last_updated TEXT
-            )
-        ''')
+            # Agents table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS agents (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    character_id INTEGER,
+                    capabilities TEXT,
+                    status TEXT DEFAULT 'inactive'
+                )
+            ''')
         
-        # Agents table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS agents (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                character_id INTEGER,
-                capabilities TEXT,
-                status TEXT DEFAULT 'inactive'
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        self.migrate()
+    
+    def migrate(self):
+        """Apply the MIGRATIONS this database hasn't seen yet, each in its own transaction"""
+        conn = get_connection(self.db_path)
+        for version, statements in enumerate(MIGRATIONS, start=1):
+            if conn.execute('PRAGMA user_version').fetchone()[0] >= version:
+                continue
+            with transaction(self.db_path) as cursor:
+                cursor.execute('BEGIN IMMEDIATE')  # Take the write lock so concurrent processes migrate once
+                if cursor.execute('PRAGMA user_version').fetchone()[0] >= version:
+                    continue
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.execute(f'PRAGMA user_version = {version}')
+            logger.info(f"Applied schema migration {version} to {self.db_path}")
+    
+    def create_knowledge_index(self):
+        """Mirror knowledge_context into an FTS5 table kept in sync by triggers; returns False without FTS5"""
+        try:
+            with transaction(self.db_path) as cursor:
+                exists = cursor.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'knowledge_fts'"
+                ).fetchone()
+                cursor.execute('''
+                    CREATE VIRTUAL TABLE IF NOT EXISTS knowledge_fts USING fts5(
+                        topic, information,
+                        content='knowledge_context', content_rowid='id',
+                        tokenize='porter unicode61'
+                    )
+                ''')
+                cursor.execute('''
+                    CREATE TRIGGER IF NOT EXISTS knowledge_fts_insert AFTER INSERT ON knowledge_context BEGIN
+                        INSERT INTO knowledge_fts(rowid, topic, information) VALUES (new.id, new.topic, new.information);
+                    END
+                ''')
+                cursor.execute('''
+                    CREATE TRIGGER IF NOT EXISTS knowledge_fts_delete AFTER DELETE ON knowledge_context BEGIN
+                        INSERT INTO knowledge_fts(knowledge_fts, rowid, topic, information)
+                        VALUES ('delete', old.id, old.topic, old.information);
+                    END
+                ''')
+                cursor.execute('''
+                    CREATE TRIGGER IF NOT EXISTS knowledge_fts_update AFTER UPDATE OF topic, information ON knowledge_context BEGIN
+                        INSERT INTO knowledge_fts(knowledge_fts, rowid, topic, information)
+                        VALUES ('delete', old.id, old.topic, old.information);
+                        INSERT INTO knowledge_fts(rowid, topic, information) VALUES (new.id, new.topic, new.information);
+                    END
+                ''')
+                if not exists:
+                    # Index the rows learned before the FTS table existed
+                    cursor.execute("INSERT INTO knowledge_fts(knowledge_fts) VALUES ('rebuild')")
+            return True
+        except sqlite3.OperationalError as e:
+            logger.warning(f"FTS5 unavailable ({e}); knowledge lookups fall back to keyword matching")
+            return False
+    
+    def _insert(self, sql, params):
+        """Queue an append-only insert on the write-behind writer, or run it now if that is disabled"""
+        if self.writer is not None:
+            self.writer.put(sql, params)
+            return
+        with transaction(self.db_path) as cursor:
+            cursor.execute(sql, params)
+    
+    def flush_writes(self, timeout=None):
+        """Wait until queued history and instruction inserts are committed"""
+        return self.writer.flush(timeout) if self.writer is not None else True
     
     def save_to_conversation_history(self, role, content):
-        """Save a message to the conversation history database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """Save a message to the conversation history database (committed in the background)"""
         timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-        cursor.execute('INSERT INTO conversation_history (timestamp, role, content) VALUES (?, ?, ?)', 
-                      (timestamp, role, content))
-        conn.commit()
-        conn.close()
+        self._insert('INSERT INTO conversation_history (timestamp, role, content) VALUES (?, ?, ?)', 
+                     (timestamp, role, content))
+    
+    def get_next_history_id(self):
+        """The id the next conversation_history row will get; a ``before_id`` that excludes it and later rows"""
+        self.flush_writes()
+        conn = get_connection(self.db_path)
+        newest = conn.execute('SELECT MAX(id) FROM conversation_history').fetchone()[0]
+        archived = conn.execute('SELECT MAX(last_id) FROM conversation_archive').fetchone()[0]
+        return max(newest or 0, archived or 0) + 1
+    
+    def get_conversation_page(self, before_id=None, limit=HISTORY_PAGE_SIZE):
+        """Up to ``limit`` messages older than ``before_id`` (the newest when None), oldest first
+        
+        Rows are ``(id, timestamp, role, content)``; pass the first row's id as ``before_id``
+        to get the page before it. Once the live table runs out, paging continues into
+        the archive.
+        """
+        self.flush_writes()
+        conn = get_connection(self.db_path)
+        before = before_id if before_id is not None else 2 ** 63 - 1
+        rows = conn.execute(
+            'SELECT id, timestamp, role, content FROM conversation_history WHERE id < ? ORDER BY id DESC LIMIT ?',
+            (before, limit)
+        ).fetchall()
+        if len(rows) < limit:
+            before = rows[-1][0] if rows else before
+            archives = conn.execute(
+                'SELECT payload FROM conversation_archive WHERE first_id < ? ORDER BY last_id DESC', (before,)
+            )
+            for (payload,) in archives:
+                archived = [tuple(row) for row in json.loads(zlib.decompress(payload)) if row[0] < before]
+                rows.extend(reversed(archived))
+                if len(rows) >= limit:
+                    break
+        return rows[:limit][::-1]
+    
+    def archive_conversation_history(self, keep_rows=HISTORY_RETAIN_ROWS, keep_days=HISTORY_RETAIN_DAYS):
+        """Move messages outside the newest ``keep_rows`` and older than ``keep_days`` into the archive
+        
+        Returns the number of messages archived.
+        """
+        self.flush_writes()
+        cutoff = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(time.time() - keep_days * 86400))
+        archived = 0
+        while True:
+            with transaction(self.db_path) as cursor:
+                rows = cursor.execute('''
+                    SELECT id, timestamp, role, content FROM conversation_history
+                    WHERE id < (SELECT id FROM conversation_history ORDER BY id DESC LIMIT 1 OFFSET ?)
+                      AND timestamp < ?
+                    ORDER BY id LIMIT ?
+                ''', (max(keep_rows - 1, 0), cutoff, ARCHIVE_CHUNK)).fetchall()
+                if not rows:
+                    break
+                payload = zlib.compress(json.dumps(rows).encode("utf-8"))
+                cursor.execute(
+                    '''INSERT INTO conversation_archive (first_id, last_id, first_timestamp, last_timestamp, row_count, payload)
+                       VALUES (?, ?, ?, ?, ?, ?)''',
+                    (rows[0][0], rows[-1][0], rows[0][1], rows[-1][1], len(rows), payload)
+                )
+                cursor.executemany('DELETE FROM conversation_history WHERE id = ?', [(row[0],) for row in rows])
+            archived += len(rows)
+            if len(rows) < ARCHIVE_CHUNK:
+                break
+        if archived:
+            logger.info(f"Archived {archived} conversation history messages")
+        return archived
     
     def get_context(self):
         """Get context from the database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT job, name FROM context WHERE id = 1')
-        context = cursor.fetchone()
-        conn.close()
-        return context
+        return self.cache.get("context", lambda: get_connection(self.db_path).execute(
+            'SELECT job, name FROM context WHERE id = 1'
+        ).fetchone())
     
     def save_context(self, job, name):
         """Save context to the database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('INSERT OR REPLACE INTO context (id, job, name) VALUES (1, ?, ?)', (job, name))
-        conn.commit()
-        conn.close()
+        with transaction(self.db_path) as cursor:
+            cursor.execute('INSERT OR REPLACE INTO context (id, job, name) VALUES (1, ?, ?)', (job, name))
+        self.cache.invalidate("context")
     
     def save_director_info(self, goals, character_names):
         """Save director information to the database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
         # Convert character_names array to a JSON string if it's a list
         if isinstance(character_names, list):
             character_names = json.dumps(character_names)
-        cursor.execute('INSERT OR REPLACE INTO director (id, goals, character_names) VALUES (1, ?, ?)', 
-                      (goals, character_names))
-        conn.commit()
-        conn.close()
+        with transaction(self.db_path) as cursor:
+            cursor.execute('INSERT OR REPLACE INTO director (id, goals, character_names) VALUES (1, ?, ?)', 
+                          (goals, character_names))
+        self.cache.invalidate("director")
     
     def get_director_info(self):
         """Get director information from the database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT goals, character_names FROM director WHERE id = 1')
-        director = cursor.fetchone()
-        conn.close()
+        director = self.cache.get("director", self._load_director_info)
+        if director:
+            # Copy so callers can't change the cached record
+            return {"goals": director["goals"], "character_names": list(director["character_names"])}
+        return None
+    
+    def _load_director_info(self):
+        director = get_connection(self.db_path).execute(
+            'SELECT goals, character_names FROM director WHERE id = 1'
+        ).fetchone()
         
         if director:
             goals, character_names = director
@@ -149,108 +349,271 @@ class DatabaseManager:
     
     def get_characters(self):
         """Get all characters from the database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT id, name, description FROM characters')
-        characters = cursor.fetchall()
-        conn.close()
-        return characters
+        return list(self.cache.get("characters", lambda: tuple(get_connection(self.db_path).execute(
+            'SELECT id, name, description FROM characters'
+        ).fetchall())))
     
     def save_character(self, name, description=""):
         """Save a character to the database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('INSERT INTO characters (name, description) VALUES (?, ?)', (name, description))
-        char_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return char_id
+        with transaction(self.db_path) as cursor:
+            cursor.execute('INSERT INTO characters (name, description) VALUES (?, ?)', (name, description))
+            character_id = cursor.lastrowid
+        self.cache.invalidate("characters")
+        return character_id
+    
+    def save_characters(self, names, description=""):
+        """Save several characters in one transaction; returns their ids in order"""
+        with transaction(self.db_path) as cursor:
+            character_ids = []
+            for name in names:
+                cursor.execute('INSERT INTO characters (name, description) VALUES (?, ?)', (name, description))
+                character_ids.append(cursor.lastrowid)
+        self.cache.invalidate("characters")
+        return character_ids
+    
+    def create_agents(self, characters):
+        """Register an agent for each ``(character_id, name, ...)`` row in one transaction
+        
+        Characters that already have an agent keep it. Returns {character_id: agent_id}.
+        """
+        with transaction(self.db_path) as cursor:
+            return self._create_agents(cursor, characters)
+    
+    def _create_agents(self, cursor, characters):
+        characters = [(row[0], row[1]) for row in characters]
+        if not characters:
+            return {}
+        cursor.executemany('''
+            INSERT INTO agents (name, character_id, capabilities, status) VALUES (?, ?, ?, 'ready')
+            ON CONFLICT(character_id) DO UPDATE SET status = excluded.status
+        ''', [(f"Agent-{name}", character_id, json.dumps(["basic"])) for character_id, name in characters])
+        placeholders = ",".join("?" * len(characters))
+        return dict(cursor.execute(
+            f'SELECT character_id, id FROM agents WHERE character_id IN ({placeholders})',
+            [character_id for character_id, _ in characters]
+        ).fetchall())
+    
+    def replace_director_and_characters(self, goals, character_names):
+        """Save the director record and make ``character_names`` the character list, each with an agent
+        
+        Runs in one transaction. Characters whose name is listed keep their id and agent;
+        the others are deleted with their agents. Returns the rows ``get_characters`` would.
+        """
+        names = list(dict.fromkeys(name.strip() for name in character_names if name.strip()))
+        with transaction(self.db_path) as cursor:
+            cursor.execute('INSERT OR REPLACE INTO director (id, goals, character_names) VALUES (1, ?, ?)',
+                           (goals, json.dumps(names)))
+            kept, stale = {}, []
+            for character_id, name in cursor.execute('SELECT id, name FROM characters ORDER BY id').fetchall():
+                if name in names and name not in kept:
+                    kept[name] = character_id
+                else:
+                    stale.append((character_id,))
+            cursor.executemany('DELETE FROM agents WHERE character_id = ?', stale)
+            cursor.executemany('DELETE FROM characters WHERE id = ?', stale)
+            for name in names:
+                if name not in kept:
+                    cursor.execute('INSERT INTO characters (name, description) VALUES (?, ?)', (name, ""))
+                    kept[name] = cursor.lastrowid
+            self._create_agents(cursor, [(kept[name], name) for name in names])
+            characters = cursor.execute('SELECT id, name, description FROM characters').fetchall()
+        self.cache.invalidate("director", "characters")
+        return characters
     
     def update_character(self, character_id, name, description=""):
         """Update a character in the database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('UPDATE characters SET name = ?, description = ? WHERE id = ?', (name, description, character_id))
-        conn.commit()
-        conn.close()
+        with transaction(self.db_path) as cursor:
+            cursor.execute('UPDATE characters SET name = ?, description = ? WHERE id = ?', (name, description, character_id))
+        self.cache.invalidate("characters")
     
     def delete_character(self, character_id):
         """Delete a character from the database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM characters WHERE id = ?', (character_id,))
-        conn.commit()
-        conn.close()
+        with transaction(self.db_path) as cursor:
+            cursor.execute('DELETE FROM characters WHERE id = ?', (character_id,))
+        self.cache.invalidate("characters")
     
     def clear_context_db(self):
         """Clear all context-related data from the database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Clear director table
-        try:
-            cursor.execute('DELETE FROM director')
-        except sqlite3.OperationalError:
-            # Table might not exist yet
-            pass
-            
-        # Clear other tables
-        cursor.execute('DELETE FROM context')
-        cursor.execute('DELETE FROM characters')
-        cursor.execute('DELETE FROM agents')
-        
-        conn.commit()
-        conn.close()
+        with transaction(self.db_path) as cursor:
+            # Clear director table
+            try:
+                cursor.execute('DELETE FROM director')
+            except sqlite3.OperationalError:
+                # Table might not exist yet
+                pass
+                
+            # Clear other tables
+            cursor.execute('DELETE FROM context')
+            cursor.execute('DELETE FROM characters')
+            cursor.execute('DELETE FROM agents')
+        self.cache.invalidate()
     
     def save_instruction(self, instruction):
-        """Save a user instruction to the database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """Save a user instruction to the database (committed in the background)"""
         timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-        cursor.execute('INSERT INTO instructions (timestamp, instruction) VALUES (?, ?)', 
-                       (timestamp, instruction))
-        instruction_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return instruction_id
+        self._insert('INSERT INTO instructions (timestamp, instruction) VALUES (?, ?)', 
+                     (timestamp, instruction))
     
     def save_knowledge_context(self, topic, information, confidence=0.7):
         """Save learned information to the knowledge context database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
         timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+        embedding = self._embed_knowledge([(topic, information)])  # Before the transaction; it's a network call
+        blob = encode_embedding(embedding[0]) if embedding else None
+        with transaction(self.db_path) as cursor:
+            # Insert a new topic, or replace an existing one only if this is more confident
+            cursor.execute('''
+                INSERT INTO knowledge_context (topic, information, confidence, last_updated, embedding, embedding_model)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(topic) DO UPDATE SET
+                    information = excluded.information,
+                    confidence = excluded.confidence,
+                    last_updated = excluded.last_updated,
+                    embedding = excluded.embedding,
+                    embedding_model = excluded.embedding_model
+                WHERE excluded.confidence > knowledge_context.confidence
+            ''', (topic, information, confidence, timestamp, blob, self.embedding_model if blob else None))
+            row = None
+            if cursor.rowcount > 0:  # 0 when the stored fact was more confident and kept
+                row = cursor.execute('SELECT id FROM knowledge_context WHERE topic = ?', (topic,)).fetchone()
         
-        # Check if topic exists
-        cursor.execute('SELECT id FROM knowledge_context WHERE topic = ?', (topic,))
-        result = cursor.fetchone()
+        index = self._loaded_knowledge_index()
+        if row and index is not None:
+            if embedding:
+                index.upsert([row[0]], embedding)
+            else:
+                index.needs_backfill = True  # Embed it on the next lookup
+    
+    def _embed_knowledge(self, rows):
+        """Embed ``(topic, information)`` rows; returns None if there is no embedder or it fails"""
+        if self.embeddings is None:
+            return None
+        try:
+            return self.embeddings.embed_documents([f"{topic}: {information}" for topic, information in rows])
+        except Exception as e:
+            logger.warning(f"Could not embed knowledge: {e}")
+            return None
+    
+    def _loaded_knowledge_index(self):
+        index = get_knowledge_index(self.db_path, self.embedding_model) if self.embeddings is not None else None
+        return index if index is not None and index.loaded else None
+    
+    def knowledge_index(self):
+        """The semantic index for this embedding model, loaded from the stored BLOBs on first use
+        
+        Rows without an embedding from this model are embedded and stored first, so a
+        model change or facts saved while Ollama was down catch up here. Once loaded,
+        the backfill runs again after a save whose embedding failed and every
+        KNOWLEDGE_BACKFILL_INTERVAL seconds, adding the rows it embeds to the index.
+        """
+        if self.embeddings is None:
+            return None
+        index = get_knowledge_index(self.db_path, self.embedding_model)
+        if index.loaded and not index.needs_backfill and \
+                time.monotonic() - index.backfilled_at < KNOWLEDGE_BACKFILL_INTERVAL:
+            return index
+        index.needs_backfill = False
+        index.backfilled_at = time.monotonic()
+        if not self._backfill_knowledge_embeddings(index if index.loaded else None):
+            return index if index.loaded else None  # Embedder unavailable; retry after the interval
+        if index.loaded:
+            return index
         
-        if result:
-            # Update existing topic if confidence is higher
-            cursor.execute('UPDATE knowledge_context SET information = ?, confidence = ?, last_updated = ? WHERE topic = ? AND confidence < ?', 
-                          (information, confidence, timestamp, topic, confidence))
-        else:
-            # Insert new topic
-            cursor.execute('INSERT INTO knowledge_context (topic, information, confidence, last_updated) VALUES (?, ?, ?, ?)', 
-                          (topic, information, confidence, timestamp))
+        rows = get_connection(self.db_path).execute(
+            'SELECT id, embedding FROM knowledge_context WHERE embedding IS NOT NULL AND embedding_model = ?',
+            (self.embedding_model,)
+        ).fetchall()
+        if rows:
+            index.upsert([row[0] for row in rows], [decode_embedding(row[1]) for row in rows])
+        index.loaded = True
+        return index
+    
+    def _backfill_knowledge_embeddings(self, index=None):
+        """Embed and store rows without an embedding from this model, adding them to ``index`` if given
+        
+        Returns False if the embedder failed before every row was done.
+        """
+        missing = get_connection(self.db_path).execute(
+            'SELECT id, topic, information FROM knowledge_context WHERE embedding IS NULL OR embedding_model IS NOT ?',
+            (self.embedding_model,)
+        ).fetchall()
+        for start in range(0, len(missing), EMBED_BATCH):
+            batch = missing[start:start + EMBED_BATCH]
+            vectors = self._embed_knowledge([(topic, information) for _, topic, information in batch])
+            if vectors is None:
+                return False
+            with transaction(self.db_path) as cursor:
+                cursor.executemany(
+                    'UPDATE knowledge_context SET embedding = ?, embedding_model = ? WHERE id = ?',
+                    [(encode_embedding(vector), self.embedding_model, row[0]) for row, vector in zip(batch, vectors)]
+                )
+            if index is not None:
+                index.upsert([row[0] for row in batch], vectors)
+        return True
+    
+    def get_relevant_knowledge(self, query, threshold=0.5, limit=KNOWLEDGE_LIMIT):
+        """Get the knowledge rows most relevant to ``query`` as ``(topic, information)``
+        
+        Semantic matches (cosine similarity of the embeddings) come first, then
+        keyword matches fill the remaining places, best BM25 match first.
+        """
+        results = {}
+        index = self.knowledge_index()
+        if index is not None and len(index):
+            try:
+                query_vector = self.embeddings.embed_query(query)
+            except Exception as e:
+                logger.warning(f"Could not embed knowledge query: {e}")
+                query_vector = None
+            if query_vector is not None:
+                # Ask for extra hits since some are dropped by the confidence threshold
+                hits = [(i, score) for i, score in index.search(query_vector, limit * 2)
+                        if score >= KNOWLEDGE_MIN_SIMILARITY]
+                if hits:
+                    placeholders = ",".join("?" * len(hits))
+                    found = {row[0]: row for row in get_connection(self.db_path).execute(
+                        f'SELECT id, topic, information FROM knowledge_context WHERE id IN ({placeholders}) AND confidence >= ?',
+                        [i for i, _ in hits] + [threshold]
+                    )}
+                    for i, _ in hits:
+                        if i in found and len(results) < limit:
+                            results[i] = found[i][1:]
+        
+        if len(results) < limit:
+            for i, topic, information in self._keyword_knowledge(query, threshold, limit):
+                if len(results) >= limit:
+                    break
+                results.setdefault(i, (topic, information))
+        return list(results.values())
+    
+    def _keyword_knowledge(self, query, threshold, limit):
+        """``(id, topic, information)`` rows sharing words with ``query``, best BM25 match first"""
+        words = re.findall(r"\w+", query.lower())
+        words = [word for word in words if word not in STOPWORDS] or words
+        if not words:
+            return []
+        if self.fts_enabled:
+            # Quote each word so FTS5 operators and punctuation in the query are taken literally
+            match = " OR ".join(f'"{word}"' for word in dict.fromkeys(words))
+            return get_connection(self.db_path).execute('''
+                SELECT k.id, k.topic, k.information
+                FROM knowledge_fts
+                JOIN knowledge_context k ON k.id = knowledge_fts.rowid
+                WHERE knowledge_fts MATCH ? AND k.confidence >= ?
+                ORDER BY bm25(knowledge_fts, ?, 1.0)
+                LIMIT ?
+            ''', (match, threshold, TOPIC_WEIGHT, limit)).fetchall()
         
-        conn.commit()
-        conn.close()
-    
-    def get_relevant_knowledge(self, query, threshold=0.5):
-        """Get relevant knowledge from the context database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT topic, information FROM knowledge_context WHERE confidence >= ?', (threshold,))
-        all_knowledge = cursor.fetchall()
-        conn.close()
+        all_knowledge = get_connection(self.db_path).execute(
+            'SELECT id, topic, information FROM knowledge_context WHERE confidence >= ?', (threshold,)
+        ).fetchall()
         
-        # Simple keyword matching for now
+        # Keyword matching on topics when this SQLite build has no FTS5
         relevant_items = []
-        query_words = set(query.lower().split())
+        query_words = set(words)
         
-        for topic, information in all_knowledge:
-            topic_words = set(topic.lower().split())
+        for knowledge_id, topic, information in all_knowledge:
+            topic_words = set(re.findall(r"\w+", topic.lower()))
             if query_words.intersection(topic_words):
-                relevant_items.append((topic, information))
+                relevant_items.append((knowledge_id, topic, information))
         
-        return relevant_items
+        return relevant_items[:limit]
@@ -0,0 +1,107 @@
+"""
+Knowledge vector index - float16 embedding BLOBs and an in-process similarity index over knowledge_context
+"""
+import os
+import threading
+
+import numpy as np
+
+try:
+    import faiss  # faiss-cpu
+except ImportError:  # pragma: no cover - depends on the environment
+    faiss = None
+
+
+def encode_embedding(vector):
+    """Pack an embedding as a float16 BLOB (half the size of float32, plenty for cosine ranking)"""
+    return np.asarray(vector, dtype=np.float16).tobytes()
+
+
+def decode_embedding(blob):
+    return np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+
+
+def _normalize(vectors):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class KnowledgeIndex:
+    """Cosine-similarity index keyed by knowledge_context id, updated one row at a time
+
+    Uses a faiss ``IndexIDMap2`` over an inner-product flat index when faiss is
+    installed, otherwise a numpy matrix. Rows are added or replaced as they are
+    written, so the index never has to be rebuilt from the table after the first load.
+
+    Search is exact on purpose rather than approximate (IVF/HNSW): learned knowledge
+    is at most a few thousand rows, where a flat scan takes well under a millisecond,
+    and replacing a row in place needs ``remove_ids``, which faiss HNSW doesn't
+    support and IVF only supports after training on data we don't have up front.
+    """
+
+    def __init__(self):
+        self.dim = None
+        self.loaded = False
+        self.needs_backfill = False  # Set when a row was saved without an embedding
+        self.backfilled_at = 0.0
+        self._index = None
+        self._vectors = {}  # numpy fallback: id -> normalized vector
+        self._matrix = None
+        self._ids = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return self._index.ntotal if self._index is not None else len(self._vectors)
+
+    def upsert(self, ids, vectors):
+        """Add or replace the vectors for ``ids``"""
+        if len(ids) == 0:
+            return
+        vectors = _normalize(vectors)
+        ids = np.asarray(ids, dtype=np.int64)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                if faiss is not None:
+                    self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(self.dim))
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding has {vectors.shape[1]} dimensions, index has {self.dim}")
+            if self._index is not None:
+                self._index.remove_ids(ids)
+                self._index.add_with_ids(vectors, ids)
+            else:
+                self._vectors.update(zip(ids.tolist(), vectors))
+                self._matrix = None
+
+    def search(self, vector, k):
+        """Return up to ``k`` ``(id, similarity)`` pairs, most similar first"""
+        query = _normalize(vector)
+        with self._lock:
+            if self.dim is None or query.shape[1] != self.dim:
+                return []
+            if self._index is not None:
+                scores, ids = self._index.search(query, min(k, self._index.ntotal))
+                return [(int(i), float(s)) for i, s in zip(ids[0], scores[0]) if i != -1]
+            if not self._vectors:
+                return []
+            if self._matrix is None:
+                self._ids = np.fromiter(self._vectors, dtype=np.int64)
+                self._matrix = np.stack(list(self._vectors.values()))
+            scores = self._matrix @ query[0]
+            top = np.argsort(-scores)[:k]
+            return [(int(self._ids[i]), float(scores[i])) for i in top]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_knowledge_index(db_path, model):
+    """Return the process-wide index for ``db_path`` and embedding ``model`` (empty until loaded)"""
+    key = (os.path.abspath(db_path), model)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = KnowledgeIndex()
+        return _indexes[key]
@@ -0,0 +1,60 @@
+"""
+Read-through cache - small, rarely written rows (director, characters, context) are read from SQLite once
+"""
+import os
+import threading
+
+
+class ReadThroughCache:
+    """Process-wide cache of query results for one database file
+
+    ``get`` returns the cached value for ``key`` or calls ``loader`` and caches what it
+    returns. ``invalidate`` drops keys after a write. A generation counter per key
+    stops a read that started before a write from caching the value it read, so a
+    concurrent writer is never overwritten by stale data. Only writes made through
+    ``DatabaseManager`` invalidate; other processes writing the same file aren't seen.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._generations = {}
+        self._epoch = 0  # Bumped when everything is invalidated
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, loader):
+        with self._lock:
+            if key in self._values:
+                self.hits += 1
+                return self._values[key]
+            self.misses += 1
+            generation = (self._epoch, self._generations.get(key, 0))
+        value = loader()
+        with self._lock:
+            if (self._epoch, self._generations.get(key, 0)) == generation:
+                self._values[key] = value
+        return value
+
+    def invalidate(self, *keys):
+        """Drop ``keys``, or everything when no keys are given"""
+        with self._lock:
+            if not keys:
+                self._values.clear()
+                self._epoch += 1
+            for key in keys:
+                self._values.pop(key, None)
+                self._generations[key] = self._generations.get(key, 0) + 1
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_read_cache(db_path):
+    """Return the process-wide cache for ``db_path``"""
+    key = os.path.abspath(db_path)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = ReadThroughCache()
+        return _caches[key]
@@ -0,0 +1,194 @@
+"""
+Vitals time-series store - HP/MP/TP/status samples per character, downsampled raw -> 10 s -> 1 min
+"""
+import os
+import time
+import logging
+import threading
+
+from database.connection import get_connection, transaction
+from database.write_behind import get_write_behind
+
+logger = logging.getLogger(__name__)
+
+VITALS_DB_PATH = os.getenv("VITALS_DB_PATH", "context/vitals.db")  # Own file so samples never wait on the chat database
+ROLLUP_INTERVAL = float(os.getenv("VITALS_ROLLUP_INTERVAL", "30"))  # Seconds between rollup passes
+ROLLUP_GRACE = 5.0  # Seconds a bucket stays open for late samples before it is rolled up
+
+# Resolution name -> (table, bucket seconds, seconds of data kept; 0 keeps everything)
+RESOLUTIONS = {
+    "raw": ("vitals_raw", 0, float(os.getenv("VITALS_RAW_HOURS", "6")) * 3600),
+    "10s": ("vitals_10s", 10, float(os.getenv("VITALS_10S_DAYS", "7")) * 86400),
+    "1m": ("vitals_1m", 60, 0),
+}
+# Spans up to this many seconds are answered from the finer resolution
+AUTO_RESOLUTION = (("raw", 15 * 60), ("10s", 6 * 3600), ("1m", float("inf")))
+
+SCHEMA = [
+    # WITHOUT ROWID clusters rows by (character, ts), so a range query per character is one index range
+    '''CREATE TABLE IF NOT EXISTS vitals_raw (
+        character TEXT NOT NULL,
+        ts REAL NOT NULL,
+        hp INTEGER, hp_max INTEGER,
+        mp INTEGER, mp_max INTEGER,
+        tp INTEGER,
+        status INTEGER,
+        PRIMARY KEY (character, ts)
+    ) WITHOUT ROWID''',
+    *[f'''CREATE TABLE IF NOT EXISTS {table} (
+        character TEXT NOT NULL,
+        ts INTEGER NOT NULL,
+        hp REAL, hp_min INTEGER, hp_max INTEGER,
+        mp REAL, mp_min INTEGER, mp_max INTEGER,
+        tp REAL, tp_max INTEGER,
+        status INTEGER,
+        samples INTEGER NOT NULL,
+        PRIMARY KEY (character, ts)
+    ) WITHOUT ROWID''' for table in ("vitals_10s", "vitals_1m")],
+    # How far each rolled-up table is complete
+    '''CREATE TABLE IF NOT EXISTS vitals_rollup (
+        resolution TEXT PRIMARY KEY,
+        done_until REAL NOT NULL
+    )''',
+]
+
+INSERT_SAMPLE = ('INSERT OR IGNORE INTO vitals_raw (character, ts, hp, hp_max, mp, mp_max, tp, status) '
+                 'VALUES (?, ?, ?, ?, ?, ?, ?, ?)')
+
+# Raw samples -> 10 s buckets; status is the highest code seen (dead outranks engaged outranks idle)
+ROLLUP_FROM_RAW = '''
+    INSERT OR REPLACE INTO {table}
+    SELECT character, CAST(ts / {bucket} AS INTEGER) * {bucket},
+           AVG(hp), MIN(hp), MAX(hp_max), AVG(mp), MIN(mp), MAX(mp_max), AVG(tp), MAX(tp),
+           MAX(status), COUNT(*)
+    FROM vitals_raw WHERE ts >= ? AND ts < ?
+    GROUP BY character, CAST(ts / {bucket} AS INTEGER)
+'''
+# Finer buckets -> coarser buckets, averages weighted by sample count
+ROLLUP_FROM_BUCKETS = '''
+    INSERT OR REPLACE INTO {table}
+    SELECT character, CAST(ts / {bucket} AS INTEGER) * {bucket},
+           SUM(hp * samples) / SUM(samples), MIN(hp_min), MAX(hp_max),
+           SUM(mp * samples) / SUM(samples), MIN(mp_min), MAX(mp_max),
+           SUM(tp * samples) / SUM(samples), MAX(tp_max),
+           MAX(status), SUM(samples)
+    FROM {source} WHERE ts >= ? AND ts < ?
+    GROUP BY character, CAST(ts / {bucket} AS INTEGER)
+'''
+
+
+class VitalsStore:
+    """Keeps a history of each character's vitals for trend charts and post-fight review
+
+    ``record`` is called on the live path (every HealthAgent read), so it only drops
+    repeated samples and queues the row on the write-behind writer. A background
+    thread rolls completed buckets up from raw samples into 10 s and then 1 min
+    averages and prunes each table past its retention. ``query`` picks the
+    resolution from the span asked for, so a chart never pulls more than a few
+    hundred rows per character.
+    """
+
+    def __init__(self, db_path=VITALS_DB_PATH, rollup_interval=ROLLUP_INTERVAL):
+        self.db_path = db_path
+        self.rollup_interval = rollup_interval
+        with transaction(db_path) as cursor:
+            for statement in SCHEMA:
+                cursor.execute(statement)
+        self.writer = get_write_behind(db_path)
+        self._last_ts = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the background rollup thread"""
+        if self._thread is None and self.rollup_interval > 0:
+            self._thread = threading.Thread(target=self._run, name="VitalsRollup", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.rollup_interval):
+            try:
+                self.rollup()
+            except Exception as e:
+                logger.warning(f"Vitals rollup failed: {e}")
+
+    def record(self, character, data):
+        """Queue one HealthCheck sample (``{"timestamp", "vitals", "state"}``) for ``character``"""
+        ts = data.get("timestamp")
+        vitals = data.get("vitals")
+        if ts is None or not vitals or self._last_ts.get(character) == ts:
+            return  # Nothing new; the addon file is re-read far more often than it changes
+        self._last_ts[character] = ts
+        row = (character, float(ts), vitals.get("hp"), vitals.get("hp_max"), vitals.get("mp"),
+               vitals.get("mp_max"), vitals.get("tp"), data.get("state", {}).get("status"))
+        if self.writer is not None:
+            self.writer.put(INSERT_SAMPLE, row)
+        else:
+            with transaction(self.db_path) as cursor:
+                cursor.execute(INSERT_SAMPLE, row)
+
+    def rollup(self, now=None):
+        """Roll completed buckets up one resolution at a time and prune expired rows"""
+        now = time.time() if now is None else now
+        if self.writer is not None:
+            self.writer.flush()
+        source = "vitals_raw"
+        for resolution in ("10s", "1m"):
+            table, bucket, _ = RESOLUTIONS[resolution]
+            sql = (ROLLUP_FROM_RAW.format(table=table, bucket=bucket) if source == "vitals_raw"
+                   else ROLLUP_FROM_BUCKETS.format(table=table, bucket=bucket, source=source))
+            with transaction(self.db_path) as cursor:
+                row = cursor.execute('SELECT done_until FROM vitals_rollup WHERE resolution = ?',
+                                     (resolution,)).fetchone()
+                start = row[0] if row else 0.0
+                end = (now - ROLLUP_GRACE) // bucket * bucket  # Only buckets that can't get more samples
+                if end > start:
+                    cursor.execute(sql, (start, end))
+                    cursor.execute('INSERT OR REPLACE INTO vitals_rollup (resolution, done_until) VALUES (?, ?)',
+                                   (resolution, end))
+            source = table
+
+        with transaction(self.db_path) as cursor:
+            for table, _, keep in RESOLUTIONS.values():
+                if keep:
+                    cursor.execute(f'DELETE FROM {table} WHERE ts < ?', (now - keep,))
+
+    def query(self, character, start, end=None, resolution=None):
+        """Samples for ``character`` between ``start`` and ``end`` (epoch seconds), oldest first
+
+        Each row is a dict with ``ts``, ``hp``, ``hp_max``, ``mp``, ``mp_max``, ``tp`` and
+        ``status``; rolled-up rows add ``hp_min``, ``mp_min``, ``tp_max`` and ``samples``.
+        Without ``resolution`` ("raw", "10s" or "1m") the finest one that keeps the
+        row count small for the span is used.
+        """
+        end = time.time() if end is None else end
+        if resolution is None:
+            resolution = next(name for name, span in AUTO_RESOLUTION if end - start <= span)
+        table, bucket, _ = RESOLUTIONS[resolution]
+        if resolution == "raw" and self.writer is not None:
+            self.writer.flush()  # Include samples still queued
+        if bucket:
+            start -= start % bucket  # Buckets are keyed by their start, so include the one containing ``start``
+        cursor = get_connection(self.db_path).execute(
+            f'SELECT * FROM {table} WHERE character = ? AND ts >= ? AND ts <= ? ORDER BY ts',
+            (character, start, end)
+        )
+        columns = [description[0] for description in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_vitals_store():
+    """Return the process-wide vitals store, starting its rollup thread on first use"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = VitalsStore()
+            _store.start()
+        return _store
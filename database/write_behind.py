@@ -0,0 +1,138 @@
+"""
+Write-behind queue - append-only inserts are committed in batches on a background thread
+"""
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+
+from database.connection import transaction, close_connection
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH", "50"))
+FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "0.5"))  # Seconds a row may wait before it is committed
+ENABLED = os.getenv("WRITE_BEHIND", "1") != "0"
+
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """Queues INSERTs and commits them from one writer thread
+
+    ``put`` returns immediately. The writer collects rows until it has ``batch_size``
+    of them or the oldest has waited ``flush_interval`` seconds, then commits the whole
+    batch in one transaction with one ``executemany`` per statement, keeping the
+    order rows were queued in. ``flush`` is a barrier: it returns once everything
+    queued before the call is committed. ``close`` flushes and stops the writer; it
+    runs at interpreter exit for every queue created by ``get_write_behind``.
+    """
+
+    def __init__(self, db_path, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.failed = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="sqlite-write-behind", daemon=True)
+        self._thread.start()
+
+    def put(self, sql, params):
+        """Queue one ``sql`` statement with its ``params`` tuple"""
+        if self._closed:
+            raise RuntimeError("write-behind queue is closed")
+        self._queue.put((sql, params))
+
+    def flush(self, timeout=None):
+        """Block until every row queued so far is committed; returns False on timeout"""
+        if self._closed:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout=5.0):
+        """Commit what is queued and stop the writer thread"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def pending(self):
+        """Approximate number of queued rows, for the UI"""
+        return self._queue.qsize()
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None  # The oldest row has waited long enough
+
+            if isinstance(item, tuple):
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(batch) < self.batch_size:
+                    continue
+
+            self._write(batch)
+            batch, deadline = [], None
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is _STOP:
+                close_connection(self.db_path)
+                return
+
+    def _write(self, batch):
+        if not batch:
+            return
+        # Group consecutive rows for the same statement so each group is one executemany
+        groups = []
+        for sql, params in batch:
+            if groups and groups[-1][0] == sql:
+                groups[-1][1].append(params)
+            else:
+                groups.append((sql, [params]))
+        try:
+            with transaction(self.db_path) as cursor:
+                for sql, rows in groups:
+                    cursor.executemany(sql, rows)
+            self.written += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            logger.error(f"Write-behind batch of {len(batch)} rows to {self.db_path} failed: {e}")
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def get_write_behind(db_path):
+    """Return the process-wide write-behind queue for ``db_path``, or None when WRITE_BEHIND=0"""
+    if not ENABLED:
+        return None
+    key = os.path.abspath(db_path)
+    with _queues_lock:
+        if key not in _queues:
+            if not _queues:
+                atexit.register(close_all)
+            _queues[key] = WriteBehindQueue(db_path)
+        return _queues[key]
+
+
+def close_all():
+    """Flush and stop every write-behind queue"""
+    with _queues_lock:
+        queues = list(_queues.values())
+        _queues.clear()
+    for writer in queues:
+        writer.close()
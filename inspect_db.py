@@ -1,20 +1,45 @@
-import sqlite3
+"""
+Database inspection and diagnostics - table dump, table/index sizes, WAL size, query plans and a micro-benchmark
+
+    python inspect_db.py             # Dump the context, director and characters tables
+    python inspect_db.py sizes       # Page usage per table and index, row counts, WAL size
+    python inspect_db.py plans       # EXPLAIN QUERY PLAN for every statement in the database code
+    python inspect_db.py bench       # Time the SELECT statements against the database
+    python inspect_db.py all         # sizes + plans + bench
+"""
+import os
+import re
+import ast
+import sys
+import time
 import json
+import sqlite3
+import argparse
 
 DB_FILE = "context/context.db"
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SQL_SOURCES = ["database/db_manager.py", "agents/ffxi_agent.py"]  # Code whose statements run against DB_FILE
+SQL_STATEMENT = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|WITH|REPLACE)\b", re.IGNORECASE)
+SAMPLE_PARAM = 1  # Bound to every placeholder; valid for comparisons, LIMIT, MATCH and bm25 weights alike
+
+
+def open_read_only(db_path):
+    """Open ``db_path`` without changing it (no journal mode or other persistent PRAGMAs)"""
+    return sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+
 
 def display_context():
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM context')
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
+    return open_read_only(DB_FILE).execute('SELECT * FROM context').fetchall()
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
 
-if __name__ == "__main__":
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
 
+def dump_tables(cursor):
     print("=== CONTEXT TABLE ===")
     cursor.execute("SELECT id, job, name FROM context")
     for row in cursor.fetchall():
@@ -37,7 +62,7 @@ if __name__ == "__main__":
                 except (json.JSONDecodeError, TypeError):
                     # If not valid JSON, display as is
                     char_names_str = char_names
-                    
+
                 print(f"ID: {id}")
                 print(f"Goals: {goals}")
                 print(f"Character Names: {char_names_str}")
@@ -50,4 +75,160 @@ if __name__ == "__main__":
         id, name, description = row
         print(f"Character ID: {id}, Name: {name}, Description: {description if description else 'None'}")
 
-    conn.close()
+
+def report_sizes(conn, db_path):
+    """Print file, WAL and per-object sizes with row counts"""
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    wal_path = f"{db_path}-wal"
+    wal_size = os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+
+    print("=== DATABASE ===")
+    print(f"File: {db_path} ({format_bytes(page_count * page_size)}, {page_count} pages of {page_size} B, "
+          f"{free_pages} free)")
+    print(f"WAL: {format_bytes(wal_size)}, journal mode {conn.execute('PRAGMA journal_mode').fetchone()[0]}, "
+          f"schema version {conn.execute('PRAGMA user_version').fetchone()[0]}")
+
+    objects = conn.execute(
+        "SELECT name, type, tbl_name FROM sqlite_master WHERE type IN ('table', 'index') ORDER BY tbl_name, type DESC"
+    ).fetchall()
+    try:
+        sizes = {name: (size, pages) for name, size, pages in conn.execute(
+            "SELECT name, SUM(pgsize), COUNT(*) FROM dbstat GROUP BY name"
+        )}
+    except sqlite3.OperationalError:
+        sizes = {}
+        print("dbstat is not available in this SQLite build; per-object sizes are skipped")
+
+    print("\n=== TABLES AND INDEXES ===")
+    print(f"{'name':<44} {'type':<6} {'size':>10} {'pages':>7} {'rows':>9}")
+    for name, kind, table in objects:
+        size, pages = sizes.get(name, (0, 0))
+        rows = ""
+        if kind == "table" and not name.startswith("sqlite_"):
+            rows = conn.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0]
+        label = name if kind == "table" else f"  {name}"
+        print(f"{label:<44} {kind:<6} {format_bytes(size) if sizes else '-':>10} {pages if sizes else '-':>7} {rows:>9}")
+
+
+def _sql_text(node):
+    """The SQL in a string or f-string node, with interpolated parts replaced by a placeholder"""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, ast.JoinedStr):
+        return "".join(part.value if isinstance(part, ast.Constant) else "?" for part in node.values)
+    return None
+
+
+def extract_statements(paths=SQL_SOURCES):
+    """Return ``[(location, sql)]`` for every SQL literal passed as the first argument of a call"""
+    statements = {}
+    for path in paths:
+        with open(os.path.join(ROOT, path), encoding="utf-8") as f:
+            tree = ast.parse(f.read(), path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Call) and node.args:
+                sql = _sql_text(node.args[0])
+                if sql and SQL_STATEMENT.match(sql):
+                    key = " ".join(sql.split())
+                    statements.setdefault(key, f"{path}:{node.lineno}")
+    return sorted(((location, sql) for sql, location in statements.items()),
+                  key=lambda item: (item[0].split(":")[0], int(item[0].split(":")[1])))
+
+
+def query_plan(conn, sql):
+    """EXPLAIN QUERY PLAN rows for ``sql`` as detail strings (nothing is executed)"""
+    params = [SAMPLE_PARAM] * sql.count("?")
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+
+def is_full_scan(detail, sql="", plan=()):
+    """Whether a plan row reads every row of its table
+
+    FTS5 lookups show up as SCAN ... VIRTUAL TABLE but use the full-text index, and
+    SCAN ... USING (COVERING) INDEX walks an index in order. A plain rowid-order
+    SCAN of a table that is only ordered and limited (``FROM t ORDER BY id DESC
+    LIMIT 1 OFFSET ?``) also stops early, as long as no temp B-tree re-sorts it.
+    """
+    if not detail.startswith("SCAN ") or any(
+        marker in detail for marker in ("VIRTUAL TABLE", "USING INDEX", "USING COVERING INDEX")
+    ):
+        return False
+    table = re.escape(detail.split()[1])
+    ordered_limit = re.search(rf"\bFROM\s+(?:\w+\s+(?:AS\s+)?)?{table}\s+ORDER\s+BY\b[^()]*?\bLIMIT\b",
+                              sql, re.IGNORECASE)
+    return not (ordered_limit and not any("TEMP B-TREE" in row for row in plan))
+
+
+def report_plans(conn, statements):
+    """Print the query plan of each statement and flag full table scans"""
+    print("=== QUERY PLANS ===")
+    flagged = []
+    for location, sql in statements:
+        print(f"\n{location}: {sql if len(sql) <= 110 else sql[:107] + '...'}")
+        try:
+            plan = query_plan(conn, sql)
+        except sqlite3.Error as e:
+            print(f"    error: {e}")
+            continue
+        for detail in plan:
+            full_scan = is_full_scan(detail, sql, plan)
+            print(f"    {detail}{'   <-- FULL SCAN' if full_scan else ''}")
+            if full_scan:
+                flagged.append(location)
+    print(f"\n{len(statements)} statements, {len(set(flagged))} with a full table scan"
+          + (f": {', '.join(sorted(set(flagged)))}" if flagged else ""))
+
+
+def report_bench(conn, statements, iterations):
+    """Time each SELECT statement ``iterations`` times against the database"""
+    print(f"=== MICRO-BENCHMARK ({iterations} runs each, every placeholder bound to {SAMPLE_PARAM!r}) ===")
+    results = []
+    for location, sql in statements:
+        if not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+            continue  # Writes would change the database
+        params = [SAMPLE_PARAM] * sql.count("?")
+        try:
+            conn.execute(sql, params).fetchall()  # Warm the page and statement caches
+            started = time.perf_counter()
+            for _ in range(iterations):
+                conn.execute(sql, params).fetchall()
+            elapsed = (time.perf_counter() - started) / iterations
+        except sqlite3.Error as e:
+            print(f"{location}: error: {e}")
+            continue
+        plan = query_plan(conn, sql)
+        full_scan = any(is_full_scan(detail, sql, plan) for detail in plan)
+        results.append((elapsed, location, full_scan, " ".join(sql.split())))
+    for elapsed, location, full_scan, sql in sorted(results, reverse=True):
+        print(f"{elapsed * 1e6:>10.1f} us  {location:<32} {'FULL SCAN ' if full_scan else ''}{sql[:70]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the context database and check its schema against the queries the app runs")
+    parser.add_argument("command", nargs="?", default="dump", choices=["dump", "sizes", "plans", "bench", "all"])
+    parser.add_argument("--db", default=DB_FILE, help="Database file")
+    parser.add_argument("--iterations", type=int, default=1000, help="Runs per statement for bench")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        sys.exit(f"No database at {args.db}")
+    conn = open_read_only(args.db)
+
+    if args.command == "dump":
+        dump_tables(conn.cursor())
+        return
+    statements = extract_statements()
+    if args.command in ("sizes", "all"):
+        report_sizes(conn, args.db)
+        print()
+    if args.command in ("plans", "all"):
+        report_plans(conn, statements)
+        print()
+    if args.command in ("bench", "all"):
+        report_bench(conn, statements, args.iterations)
+
+
+if __name__ == "__main__":
+    main()
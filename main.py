@@ -1,16 +1,11 @@
 import os
-import sqlite3
 from context.initial_greeting import initial_greeting
+from database.connection import get_connection
 
 DB_FILE = "context/context.db"
 
 def get_context():
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT job, name FROM context WHERE id = 1')
-    context = cursor.fetchone()
-    conn.close()
-    return context
+    return get_connection(DB_FILE).execute('SELECT job, name FROM context WHERE id = 1').fetchone()
 
 def main():
     context = get_context()
@@ -10,6 +10,9 @@ from streamlit.components.v1 import html
 import uuid
 import json
 from ui.ui_helpers import UIComponents, UIStyles
+from database.vitals_store import get_vitals_store
+
+TREND_WINDOWS = {"15 minutes": 15 * 60, "1 hour": 3600, "6 hours": 6 * 3600, "24 hours": 24 * 3600}
 
 logger = logging.getLogger("health_dashboard")
 
@@ -331,6 +334,17 @@ class HealthDashboard:
             # Render health bars
             self._render_character_bars(char_name, status, large=True)
         
+        # Vitals history from the time-series store
+        st.markdown("### Vitals Trend")
+        window = st.selectbox("Window", list(TREND_WINDOWS), key=f"trend_window_{char_name}")
+        samples = get_vitals_store().query(char_name, time.time() - TREND_WINDOWS[window])
+        if samples:
+            trend = pd.DataFrame(samples)
+            trend["time"] = pd.to_datetime(trend["ts"], unit="s")
+            st.line_chart(trend.set_index("time")[["hp", "mp", "tp"]])
+        else:
+            st.markdown("No vitals recorded yet.")
+        
         # Display buffs
         if status.get("status") != "No data available":
             st.markdown("### Active Buffs")
@@ -3,6 +3,8 @@ from streamlit.components.v1 import html
 import time
 from ui.health_dashboard import HealthDashboard
 
+CHAT_RENDER_PAGE = 30  # Messages rendered per rerun; older ones load on request
+
 class UIManager:
     """Class to handle UI components and styling"""
     
@@ -192,7 +194,7 @@ class UIManager:
         """
         html(toast_html, height=0)
     
-    def setup_sidebar(self, db_manager, reranker, embeddings_model, ollama_base_url):
+    def setup_sidebar(self, db_manager, reranker, embeddings_model, ollama_base_url, model=None):
         """Set up the sidebar with all components"""
         with st.sidebar:
             st.header("📁 Document Management")
@@ -205,7 +207,8 @@ class UIManager:
             if uploaded_files and not st.session_state.documents_loaded:
                 with st.spinner("Processing documents..."):
                     from utils.doc_handler import process_documents
-                    process_documents(uploaded_files, reranker, embeddings_model, ollama_base_url)
+                    process_documents(uploaded_files, reranker, embeddings_model, ollama_base_url,
+                                      model if st.session_state.get("enable_community_summaries") else None)
                     st.success("Documents processed!")
             
             st.markdown("---")
@@ -215,6 +218,10 @@ class UIManager:
             st.session_state.enable_hyde = st.checkbox("Enable HyDE", value=True)
             st.session_state.enable_reranking = st.checkbox("Enable Neural Reranking", value=True)
             st.session_state.enable_graph_rag = st.checkbox("Enable GraphRAG", value=True)
+            st.session_state.graph_rag_mode = st.selectbox("GraphRAG Mode", ["Multi-hop", "PageRank", "Community"],
+                                                           help="PageRank ranks chunks by personalized PageRank; Community answers broad questions from precomputed graph communities")
+            st.session_state.enable_community_summaries = st.checkbox("Summarize Graph Communities", value=False,
+                                                                      help="Generate a cached LLM summary per community when documents are processed")
             st.session_state.temperature = st.slider("Temperature", 0.0, 1.0, 0.3, 0.05)
             st.session_state.max_contexts = st.slider("Max Contexts", 1, 5, 3)
             
@@ -308,9 +315,35 @@ class UIManager:
             # Render the dashboard
             self.health_dashboard.render_dashboard()
     
-    def display_messages(self, message_container):
-        """Display all messages in the chat history within the given container"""
+    def display_messages(self, message_container, db_manager=None):
+        """Display the newest chat messages within the given container
+        
+        Only the last CHAT_RENDER_PAGE messages are rendered. "Load older messages"
+        first reveals the rest of this session's messages (including those trimmed
+        from session state), then pages of stored history from before this session
+        from ``db_manager``, so a long session doesn't re-render everything.
+        """
+        visible = st.session_state.setdefault("visible_messages", CHAT_RENDER_PAGE)
         with message_container:
-            for message in st.session_state.messages:
+            loaded = len(st.session_state.get("older_messages", [])) + len(st.session_state.messages)
+            more_stored = db_manager is not None and st.session_state.get("history_cursor", -1) != -1
+            if (visible < loaded or more_stored) and st.button("⬆️ Load older messages"):
+                if visible >= loaded:
+                    self.load_older_history(db_manager)
+                st.session_state.visible_messages = visible = visible + CHAT_RENDER_PAGE
+            
+            shown = (st.session_state.get("older_messages", []) + st.session_state.messages)[-visible:]
+            for message in shown:
                 with st.chat_message(message["role"]):
                     st.markdown(message["content"])
+    
+    def load_older_history(self, db_manager):
+        """Prepend the next page of stored conversation history from before ``history_cursor`` to the chat view
+        
+        The cursor starts at the first id this session persisted, so neither this
+        session's messages nor other sessions' later turns are paged in.
+        """
+        page = db_manager.get_conversation_page(before_id=st.session_state.history_cursor, limit=CHAT_RENDER_PAGE)
+        older = [{"role": role, "content": content} for _, _, role, content in page]
+        st.session_state.older_messages = older + st.session_state.get("older_messages", [])
+        st.session_state.history_cursor = page[0][0] if len(page) == CHAT_RENDER_PAGE else -1  # -1: nothing older
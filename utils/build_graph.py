@@ -1,33 +1,320 @@
 import streamlit as st
 import networkx as nx
+import numpy as np
+from scipy import sparse
+import hashlib
+import heapq
+import json
+import os
 import re
+from langchain_core.documents import Document
+from utils.entity_extractor import extract_entities
 
-def build_knowledge_graph(docs):
+COOCCURRENCE_WINDOW = 5    # Entities at most this many mentions apart in a chunk are linked
+MIN_QUERY_WORD_LENGTH = 3  # Shorter query words ("a", "of") would match almost every node
+COMMUNITY_SUMMARY_CACHE = "context/community_summaries.json"
+
+
+def build_knowledge_graph(docs, window=COOCCURRENCE_WINDOW, workers=None):
+    """Build a weighted entity co-occurrence graph with chunk provenance
+
+    Entities come from ``extract_entities`` (regex + FFXI glossary, spread across a
+    process pool for large uploads). Nodes carry a ``chunks`` dict (chunk index ->
+    mention count) and edges carry a ``weight`` (total co-occurrences) plus their own
+    ``chunks`` dict, so retrieval can map graph hits back to the source text. The chunks themselves are kept in
+    ``G.graph["chunks"]`` in the order they were indexed.
+    """
     G = nx.Graph()
-    for doc in docs:
-        entities = re.findall(r'\b[A-Z][a-z]+(?: [A-Z][a-z]+)*\b', doc.page_content)
-        # Ensure meaningful relationships exist
-        if len(entities) > 1:
-            for i in range(len(entities) - 1):
-                G.add_edge(entities[i], entities[i + 1])  # Create edge
+    G.graph["chunks"] = list(docs)
+    entity_lists = extract_entities((doc.page_content for doc in G.graph["chunks"]), workers=workers)
+    for chunk_id, entities in enumerate(entity_lists):
+        for entity in entities:
+            if entity not in G:
+                G.add_node(entity, chunks={})
+            node_chunks = G.nodes[entity]["chunks"]
+            node_chunks[chunk_id] = node_chunks.get(chunk_id, 0) + 1
+
+        # Link every pair of distinct entities that appear close to each other
+        for i in range(len(entities)):
+            for j in range(i + 1, min(i + 1 + window, len(entities))):
+                source, target = entities[i], entities[j]
+                if source == target:
+                    continue
+                if G.has_edge(source, target):
+                    G[source][target]["weight"] += 1
+                else:
+                    G.add_edge(source, target, weight=1, chunks={})
+                edge_chunks = G[source][target]["chunks"]
+                edge_chunks[chunk_id] = edge_chunks.get(chunk_id, 0) + 1
     return G
 
 
-def retrieve_from_graph(query, G, top_k=5):
+def match_query_nodes(query, G):
+    """Return {node: seed score} for graph nodes mentioned by the query"""
+    query_words = [word for word in re.findall(r"\w+", query.lower()) if len(word) >= MIN_QUERY_WORD_LENGTH]
+    seeds = {}
+    for node in G.nodes:
+        node_lower = node.lower()
+        hits = sum(1 for word in query_words if word in node_lower)
+        if hits:
+            seeds[node] = float(hits)
+    return seeds
+
+
+def expand_from_seeds(G, seeds, max_depth=2, max_expansions=200, decay=0.5):
+    """Best-first weighted multi-hop expansion with a fixed compute budget
+
+    Scores flow from the seed nodes along edges, scaled by ``decay`` per hop and by
+    the edge weight relative to the strongest edge of the node being expanded. At
+    most ``max_expansions`` nodes are expanded and no path is longer than
+    ``max_depth`` hops, so the cost is bounded regardless of graph size.
+
+    Returns ``(node_scores, edge_scores)`` where edge_scores maps each traversed
+    edge to the score it propagated.
+    """
+    node_scores = dict(seeds)
+    edge_scores = {}
+    heap = [(-score, node, 0) for node, score in seeds.items()]
+    heapq.heapify(heap)
+    expanded = set()
+
+    while heap and len(expanded) < max_expansions:
+        neg_score, node, depth = heapq.heappop(heap)
+        if node in expanded or -neg_score < node_scores.get(node, 0.0):
+            continue  # Stale heap entry, a better path was already found
+        expanded.add(node)
+        if depth >= max_depth:
+            continue
+
+        neighbors = G[node]
+        if not neighbors:
+            continue
+        max_weight = max(data.get("weight", 1) for data in neighbors.values())
+        for neighbor, data in neighbors.items():
+            score = -neg_score * decay * (data.get("weight", 1) / max_weight)
+            edge_scores[(node, neighbor)] = max(edge_scores.get((node, neighbor), 0.0), score)
+            if score > node_scores.get(neighbor, 0.0):
+                node_scores[neighbor] = score
+                heapq.heappush(heap, (-score, neighbor, depth + 1))
+
+    return node_scores, edge_scores
+
+
+def rank_chunks(G, node_scores, edge_scores=None, top_k=5):
+    """Aggregate node/edge scores onto their source chunks and return the top_k Documents"""
+    chunk_scores = {}
+    for node, score in node_scores.items():
+        for chunk_id in G.nodes[node].get("chunks", {}):
+            chunk_scores[chunk_id] = chunk_scores.get(chunk_id, 0.0) + score
+    for (source, target), score in (edge_scores or {}).items():
+        for chunk_id in G[source][target].get("chunks", {}):
+            chunk_scores[chunk_id] = chunk_scores.get(chunk_id, 0.0) + score
+
+    chunks = G.graph.get("chunks", [])
+    top_chunks = heapq.nlargest(top_k, chunk_scores.items(), key=lambda item: item[1])
+    return [
+        Document(
+            page_content=chunks[chunk_id].page_content,
+            metadata={**chunks[chunk_id].metadata, "source_type": "graph", "graph_score": round(score, 4)}
+        )
+        for chunk_id, score in top_chunks
+        if chunk_id < len(chunks)
+    ]
+
+
+def retrieve_from_graph(query, G, top_k=5, max_depth=2, max_expansions=200):
+    """Return the source chunks that score highest in a multi-hop expansion around the query's entities"""
     st.write(f"🔎 Searching GraphRAG for: {query}")
 
-    # Convert query into words to match knowledge graph nodes
-    query_words = query.lower().split()
-    matched_nodes = [node for node in G.nodes if any(word in node.lower() for word in query_words)]
-    
-    if matched_nodes:
-        related_nodes = []
-        for node in matched_nodes:
-            related_nodes.extend(list(G.neighbors(node)))  # Get connected nodes
-        
-        st.write(f"🟢 GraphRAG Matched Nodes: {matched_nodes}")
-        st.write(f"🟢 GraphRAG Retrieved Related Nodes: {related_nodes[:top_k]}")
-        return related_nodes[:top_k]
-    
+    seeds = match_query_nodes(query, G)
+    if seeds:
+        node_scores, edge_scores = expand_from_seeds(G, seeds, max_depth=max_depth, max_expansions=max_expansions)
+        graph_docs = rank_chunks(G, node_scores, edge_scores, top_k=top_k)
+
+        st.write(f"🟢 GraphRAG Matched Nodes: {list(seeds)}")
+        st.write(f"🟢 GraphRAG Scored Nodes: {len(node_scores)}, Retrieved Chunks: {len(graph_docs)}")
+        return graph_docs
+
     st.write(f"❌ No graph results found for: {query}")
     return []
+
+
+def detect_communities(G, seed=42, max_chunks_per_community=20):
+    """Partition the graph into communities once at index time
+
+    Uses weighted Louvain when this networkx provides it and label propagation
+    otherwise. Each community is stored in ``G.graph["communities"]`` with its member
+    nodes, its most-mentioned source chunks and a ``summary`` slot for
+    ``summarize_communities``; every node gets a ``community`` attribute.
+    """
+    if G.number_of_nodes() == 0:
+        G.graph["communities"] = []
+        return G.graph["communities"]
+
+    try:
+        partition = nx.community.louvain_communities(G, weight="weight", seed=seed)
+    except AttributeError:
+        partition = nx.community.label_propagation_communities(G)
+
+    communities = []
+    for community_id, members in enumerate(sorted(partition, key=len, reverse=True)):
+        chunk_mentions = {}
+        for node in members:
+            G.nodes[node]["community"] = community_id
+            for chunk_id, count in G.nodes[node].get("chunks", {}).items():
+                chunk_mentions[chunk_id] = chunk_mentions.get(chunk_id, 0) + count
+        top_chunks = heapq.nlargest(max_chunks_per_community, chunk_mentions.items(), key=lambda item: item[1])
+        communities.append({
+            "id": community_id,
+            "nodes": sorted(members),
+            "chunks": [chunk_id for chunk_id, _ in top_chunks],
+            "summary": None
+        })
+
+    G.graph["communities"] = communities
+    return communities
+
+
+def summarize_communities(G, summarize, cache_path=COMMUNITY_SUMMARY_CACHE, min_size=3, max_chunks=5):
+    """Attach an LLM summary to each community, reusing cached summaries when the content is unchanged
+
+    ``summarize`` takes the concatenated member chunks and returns summary text. The
+    cache is keyed by a hash of that text, so re-uploading the same documents costs
+    no generations.
+    """
+    cache = {}
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            cache = {}
+
+    chunks = G.graph.get("chunks", [])
+    updated = False
+    for community in G.graph.get("communities", []):
+        if len(community["nodes"]) < min_size:
+            continue
+        text = "\n\n".join(chunks[chunk_id].page_content for chunk_id in community["chunks"][:max_chunks])
+        key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        if key not in cache:
+            try:
+                cache[key] = summarize(text)
+                updated = True
+            except Exception as e:
+                st.warning(f"Community summary failed: {str(e)}")
+                continue
+        community["summary"] = cache[key]
+
+    if updated and cache_path:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path, "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+
+
+def retrieve_from_communities(query, G, top_k=5):
+    """Answer broad questions from the precomputed community that best matches the query"""
+    st.write(f"🔎 Searching GraphRAG communities for: {query}")
+
+    communities = G.graph.get("communities")
+    seeds = match_query_nodes(query, G)
+    if not communities or not seeds:
+        st.write(f"❌ No community results found for: {query}")
+        return []
+
+    votes = {}
+    for node, score in seeds.items():
+        community_id = G.nodes[node].get("community")
+        if community_id is not None:
+            votes[community_id] = votes.get(community_id, 0.0) + score
+    community = communities[max(votes, key=votes.get)]
+
+    chunks = G.graph.get("chunks", [])
+    graph_docs = []
+    if community["summary"]:
+        graph_docs.append(Document(
+            page_content=community["summary"],
+            metadata={"source_type": "graph_community", "community": community["id"]}
+        ))
+    for chunk_id in community["chunks"][:max(0, top_k - len(graph_docs))]:
+        graph_docs.append(Document(
+            page_content=chunks[chunk_id].page_content,
+            metadata={**chunks[chunk_id].metadata, "source_type": "graph_community", "community": community["id"]}
+        ))
+
+    st.write(f"🟢 GraphRAG Community {community['id']}: {len(community['nodes'])} nodes, {len(graph_docs)} documents")
+    return graph_docs
+
+
+def build_pagerank_index(G):
+    """Precompute the column-stochastic transition matrix used by personalized PageRank"""
+    nodes = list(G.nodes)
+    if not nodes:
+        G.graph["pagerank_index"] = {"nodes": [], "index": {}, "transition": None, "dangling": None}
+        return G.graph["pagerank_index"]
+
+    adjacency = nx.to_scipy_sparse_array(G, nodelist=nodes, weight="weight", format="csr", dtype=np.float64)
+    out_strength = np.asarray(adjacency.sum(axis=1)).ravel()
+    inverse_strength = np.divide(1.0, out_strength, out=np.zeros_like(out_strength), where=out_strength > 0)
+    transition = (sparse.diags(inverse_strength) @ adjacency).T.tocsr()
+    G.graph["pagerank_index"] = {
+        "nodes": nodes,
+        "index": {node: i for i, node in enumerate(nodes)},
+        "transition": transition,
+        "dangling": out_strength == 0
+    }
+    return G.graph["pagerank_index"]
+
+
+def personalized_pagerank(G, seeds, alpha=0.85, max_iter=50, tol=1e-6):
+    """Personalized PageRank by sparse power iteration, stopping at ``max_iter`` or an L1 change below ``tol``
+
+    Returns an array of scores aligned with ``G.graph["pagerank_index"]["nodes"]``,
+    or ``[]`` for a graph without nodes.
+    """
+    pagerank_index = G.graph.get("pagerank_index") or build_pagerank_index(G)
+    if not pagerank_index["nodes"]:
+        return []
+    transition = pagerank_index["transition"]
+    dangling = pagerank_index["dangling"]
+
+    personalization = np.zeros(transition.shape[0])
+    for node, weight in seeds.items():
+        personalization[pagerank_index["index"][node]] = weight
+    personalization /= personalization.sum()
+
+    scores = personalization.copy()
+    for _ in range(max_iter):
+        # Mass stuck on dangling nodes and the teleport share both return to the seeds
+        restart = alpha * scores[dangling].sum() + (1 - alpha)
+        updated = alpha * (transition @ scores) + restart * personalization
+        converged = np.abs(updated - scores).sum() < tol
+        scores = updated
+        if converged:
+            break
+    return scores
+
+
+def retrieve_with_pagerank(query, G, top_k=5, max_nodes=100):
+    """Rank source chunks by the personalized PageRank of their entities, seeded by the query"""
+    st.write(f"🔎 Searching GraphRAG (PageRank) for: {query}")
+
+    seeds = match_query_nodes(query, G)
+    if not seeds:
+        st.write(f"❌ No graph results found for: {query}")
+        return []
+
+    scores = personalized_pagerank(G, seeds)
+    if not len(scores):
+        return []
+    nodes = G.graph["pagerank_index"]["nodes"]
+    if len(scores) > max_nodes:
+        top_indices = np.argpartition(scores, -max_nodes)[-max_nodes:]
+    else:
+        top_indices = np.arange(len(scores))
+    node_scores = {nodes[i]: float(scores[i]) for i in top_indices if scores[i] > 0}
+    graph_docs = rank_chunks(G, node_scores, top_k=top_k)
+
+    st.write(f"🟢 GraphRAG Matched Nodes: {list(seeds)}")
+    st.write(f"🟢 GraphRAG Top Ranked Nodes: {sorted(node_scores, key=node_scores.get, reverse=True)[:top_k]}")
+    return graph_docs
@@ -0,0 +1,86 @@
+"""
+Per-session reuse of Ollama's returned ``context`` tokens so each chat turn only sends the new tokens
+"""
+import os
+
+from utils.prompt_builder import count_tokens
+
+KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+
+class ConversationContext:
+    """Tracks the ``context`` Ollama returned for one session and prompt mode
+
+    The first turn sends the mode instructions as a stable ``system`` prompt plus the
+    recent chat history. Later turns send only the new message together with the
+    previous ``context``, so the model reuses its cached prefix instead of
+    re-evaluating the whole conversation. When the context would no longer fit in
+    ``num_ctx`` it is dropped and the next turn starts fresh from the chat history.
+    It is also dropped when any other message (another mode's reply, a command
+    reply, "Understood.") was added after its own last reply, since the tokens
+    don't hold that turn and no history would be sent to make up for it.
+    """
+
+    def __init__(self, instructions, num_ctx=4096, reserve_tokens=1024, model=None):
+        self.instructions = instructions
+        self.model = model
+        self.num_ctx = num_ctx
+        self.reserve_tokens = reserve_tokens  # Room left for the new turn and the answer
+        self.tokens = None
+        self.turns = 0
+        self.reply = None  # The reply this context ends with, as added to the chat
+
+    @property
+    def active(self):
+        return bool(self.tokens) and len(self.tokens) + self.reserve_tokens <= self.num_ctx
+
+    def request_params(self):
+        """Extra /api/generate fields for the next turn"""
+        if self.active:
+            return {"context": self.tokens, "keep_alive": KEEP_ALIVE}
+        return {"system": self.instructions, "keep_alive": KEEP_ALIVE}
+
+    def prompt_budget(self, answer_tokens):
+        """Tokens left for the next prompt after the reused context (or system prompt) and the answer"""
+        used = len(self.tokens) if self.active else count_tokens(self.instructions)
+        return self.num_ctx - used - answer_tokens
+
+    def update(self, done_chunk):
+        """Store the context from the final ``done`` chunk of a generation"""
+        context = done_chunk.get("context")
+        if context:
+            self.tokens = context
+            self.turns += 1
+        if not self.active:
+            self.reset()
+
+    def record_reply(self, text):
+        """Remember the reply shown for the generation whose context was stored"""
+        self.reply = text if self.active else None
+
+    def follows(self, chat_history):
+        """Whether ``chat_history`` (the messages before the new prompt) ends with this context's reply"""
+        return (self.reply is not None and bool(chat_history)
+                and chat_history[-1].get("role") == "assistant" and chat_history[-1].get("content") == self.reply)
+
+    def reset(self):
+        self.tokens = None
+        self.turns = 0
+        self.reply = None
+
+
+def get_conversation_context(session_state, mode, instructions, num_ctx=4096, model=None, chat_history=None):
+    """Return the session's ConversationContext for ``mode``, creating it on first use
+
+    Context tokens only mean something to the model that produced them, so a change
+    of model (e.g. a routing fallback) starts a fresh context. With ``chat_history``,
+    a context that missed turns added since its last reply is reset, so the next
+    turn falls back to sending the history.
+    """
+    contexts = session_state.setdefault("ollama_contexts", {})
+    if mode not in contexts or contexts[mode].instructions != instructions or contexts[mode].model != model:
+        contexts[mode] = ConversationContext(instructions, num_ctx=num_ctx, model=model)
+    conversation = contexts[mode]
+    if chat_history is not None and conversation.active and not conversation.follows(chat_history):
+        conversation.reset()
+    return conversation
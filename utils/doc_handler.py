@@ -1,17 +1,33 @@
 import streamlit as st
 from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, TextLoader
 from langchain.text_splitter import CharacterTextSplitter
-from langchain_ollama import OllamaEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain_community.retrievers import BM25Retriever
 from langchain.retrievers import EnsembleRetriever
-from utils.build_graph import build_knowledge_graph
+from utils.build_graph import build_knowledge_graph, build_pagerank_index, detect_communities, summarize_communities
 from rank_bm25 import BM25Okapi
 import os
 import re
+from utils.ollama_client import OllamaClientEmbeddings, get_ollama_client
+from utils.llm_scheduler import get_scheduler, BACKGROUND
+from utils.generation_governor import strip_thinking
 
 
-def process_documents(uploaded_files,reranker,embedding_model, base_url):
+def ollama_summarizer(base_url, model):
+    """Return a callable that summarizes a community's text with Ollama"""
+    def summarize(text):
+        response = get_scheduler().generate(
+            get_ollama_client(base_url),
+            f"Summarize the key facts in these related passages in at most 5 sentences:\n\n{text}",
+            model,
+            priority=BACKGROUND,
+            source="community_summary"
+        )
+        return strip_thinking(response.get("response", ""))
+    return summarize
+
+
+def process_documents(uploaded_files,reranker,embedding_model, base_url, summary_model=None):
     if st.session_state.documents_loaded:
         return
 
@@ -54,7 +70,7 @@ def process_documents(uploaded_files,reranker,embedding_model, base_url):
     text_contents = [doc.page_content for doc in texts]
 
     # 🚀 Hybrid Retrieval Setup
-    embeddings = OllamaEmbeddings(model=embedding_model, base_url=base_url)
+    embeddings = OllamaClientEmbeddings(model=embedding_model, base_url=base_url)
     
     # Vector store
     vector_store = FAISS.from_documents(texts, embeddings)
@@ -75,12 +91,19 @@ def process_documents(uploaded_files,reranker,embedding_model, base_url):
         weights=[0.4, 0.6]
     )
 
+    # 🚀 Knowledge Graph + communities, computed once here so queries only do lookups
+    knowledge_graph = build_knowledge_graph(texts)
+    detect_communities(knowledge_graph)
+    build_pagerank_index(knowledge_graph)
+    if summary_model:
+        summarize_communities(knowledge_graph, ollama_summarizer(base_url, summary_model))
+
     # Store in session
     st.session_state.retrieval_pipeline = {
         "ensemble": ensemble_retriever,
         "reranker": reranker,  # Now using the global reranker variable
         "texts": text_contents,
-        "knowledge_graph": build_knowledge_graph(texts)  # Store Knowledge Graph
+        "knowledge_graph": knowledge_graph  # Store Knowledge Graph
     }
 
     st.session_state.documents_loaded = True
@@ -92,4 +115,5 @@ def process_documents(uploaded_files,reranker,embedding_model, base_url):
         st.write(f"🔗 Total Nodes: {len(G.nodes)}")
         st.write(f"🔗 Total Edges: {len(G.edges)}")
         st.write(f"🔗 Sample Nodes: {list(G.nodes)[:10]}")
-        st.write(f"🔗 Sample Edges: {list(G.edges)[:10]}")
+        st.write(f"🔗 Sample Edges: {list(G.edges(data='weight'))[:10]}")
+        st.write(f"🔗 Communities: {len(G.graph.get('communities', []))}")
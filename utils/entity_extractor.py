@@ -0,0 +1,183 @@
+"""
+Entity extraction for GraphRAG - capitalized-phrase regex plus an FFXI glossary matched with Aho-Corasick
+"""
+import os
+import re
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import ahocorasick  # pyahocorasick
+except ImportError:  # pragma: no cover - depends on the environment
+    ahocorasick = None
+
+logger = logging.getLogger(__name__)
+
+ENTITY_PATTERN = re.compile(r'\b[A-Z][a-z]+(?: [A-Z][a-z]+)*\b')
+DEFAULT_GLOSSARY_PATH = os.path.join(os.path.dirname(__file__), "ffxi_glossary.json")
+CASE_SENSITIVE_KEY = "case_sensitive"  # Glossary entry listing terms that are also ordinary words
+PARALLEL_THRESHOLD = 64  # Below this many texts a process pool costs more than it saves
+
+
+def _read_glossary(path=None):
+    path = path or os.getenv("FFXI_GLOSSARY_PATH", DEFAULT_GLOSSARY_PATH)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Could not load glossary from {path}: {e}")
+        return {}
+
+
+def load_glossary(path=None):
+    """Load the glossary as {surface form: canonical name}
+
+    The file maps categories (zones, nms, jobs, items, ...) to either a list of names
+    or a dict of canonical name -> list of aliases, e.g. ``{"Blue Mage": ["BLU"]}``.
+    """
+    terms = {}
+    for category, entries in _read_glossary(path).items():
+        if category == CASE_SENSITIVE_KEY:
+            continue
+        if isinstance(entries, dict):
+            for canonical, aliases in entries.items():
+                terms[canonical] = canonical
+                for alias in aliases or []:
+                    terms[alias] = canonical
+        else:
+            for canonical in entries:
+                terms[canonical] = canonical
+    return terms
+
+
+def load_case_sensitive(path=None):
+    """Surface forms that only match exactly as written ("Remedy", but not "remedy")"""
+    return set(_read_glossary(path).get(CASE_SENSITIVE_KEY, []))
+
+
+def _is_word_char(text, index):
+    return 0 <= index < len(text) and (text[index].isalnum() or text[index] == "_")
+
+
+class EntityExtractor:
+    """Extracts entities in mention order from the glossary and the entity regex
+
+    Glossary terms are matched case-insensitively, except all-uppercase aliases such
+    as job abbreviations ("BLU", "WAR") and the glossary's ``case_sensitive`` terms
+    ("Monk", "Remedy"), which only match as written so they don't fire on ordinary
+    words. Regex phrases are split around glossary matches, so "Ru'Lude Gardens"
+    stays one entity instead of "Ru" and "Lude Gardens".
+    """
+
+    def __init__(self, terms=None, case_sensitive=None):
+        if terms is None:
+            terms, case_sensitive = load_glossary(), load_case_sensitive()
+        self.terms = terms
+        self.case_sensitive = set(case_sensitive or ())
+        exact = {term: canonical for term, canonical in self.terms.items() if self._is_exact(term)}
+        folded = {term.lower(): canonical for term, canonical in self.terms.items() if term not in exact}
+        self._folded = self._build_matcher(folded)
+        self._exact = self._build_matcher(exact)
+
+    def _is_exact(self, term):
+        return term.isupper() or term in self.case_sensitive
+
+    @staticmethod
+    def _build_matcher(terms):
+        if not terms:
+            return None
+        if ahocorasick is not None:
+            automaton = ahocorasick.Automaton()
+            for term, canonical in terms.items():
+                automaton.add_word(term, (canonical, len(term)))
+            automaton.make_automaton()
+            return automaton
+        # Fallback when pyahocorasick isn't installed: one alternation, longest terms first
+        logger.debug("pyahocorasick not available, falling back to regex glossary matching")
+        ordered = sorted(terms, key=len, reverse=True)
+        return (re.compile("|".join(re.escape(term) for term in ordered)), terms)
+
+    @staticmethod
+    def _scan(matcher, text):
+        """Yield (start, end, canonical) for whole-word glossary hits"""
+        if matcher is None:
+            return
+        if ahocorasick is not None and isinstance(matcher, ahocorasick.Automaton):
+            hits = ((end + 1 - length, end + 1, canonical) for end, (canonical, length) in matcher.iter(text))
+        else:
+            pattern, terms = matcher
+            hits = ((m.start(), m.end(), terms[m.group(0)]) for m in pattern.finditer(text))
+        for start, end, canonical in hits:
+            if not _is_word_char(text, start - 1) and not _is_word_char(text, end):
+                yield start, end, canonical
+
+    @staticmethod
+    def _regex_mentions(text, start, end):
+        return [(start + m.start(), start + m.end(), m.group(0)) for m in ENTITY_PATTERN.finditer(text[start:end])]
+
+    def extract(self, text):
+        """Return the entities in ``text`` in the order they are mentioned"""
+        spans = list(self._scan(self._exact, text)) + list(self._scan(self._folded, text.lower()))
+
+        # Prefer the longest glossary match when terms overlap ("Jeuno" inside "Lower Jeuno")
+        spans.sort(key=lambda span: (span[0], -(span[1] - span[0])))
+        glossary_spans = []
+        covered_until = -1
+        for start, end, canonical in spans:
+            if start >= covered_until:
+                glossary_spans.append((start, end, canonical))
+                covered_until = end
+
+        # Regex phrases keep whatever capitalized words lie outside the glossary matches
+        mentions = list(glossary_spans)
+        for match in ENTITY_PATTERN.finditer(text):
+            segment_start = match.start()
+            for start, end, _ in glossary_spans:
+                if end <= segment_start or start >= match.end():
+                    continue
+                mentions.extend(self._regex_mentions(text, segment_start, start))
+                segment_start = end
+            mentions.extend(self._regex_mentions(text, segment_start, match.end()))
+
+        mentions.sort(key=lambda span: span[0])
+        return [canonical for _, _, canonical in mentions]
+
+
+_worker_extractor = None
+
+
+def _init_worker(terms, case_sensitive):
+    """Build one automaton per worker process instead of one per task"""
+    global _worker_extractor
+    _worker_extractor = EntityExtractor(terms, case_sensitive)
+
+
+def _extract_in_worker(text):
+    return _worker_extractor.extract(text)
+
+
+def extract_entities(texts, terms=None, workers=None, case_sensitive=None):
+    """Extract entities from every text, using a process pool for large batches
+
+    ``workers`` defaults to the GRAPH_BUILD_WORKERS environment variable or the CPU
+    count. Falls back to in-process extraction if the pool can't be started.
+    """
+    texts = list(texts)
+    if terms is None:
+        terms, case_sensitive = load_glossary(), load_case_sensitive()
+    case_sensitive = set(case_sensitive or ())
+    workers = workers or int(os.getenv("GRAPH_BUILD_WORKERS", "0")) or os.cpu_count() or 1
+
+    if workers > 1 and len(texts) >= PARALLEL_THRESHOLD:
+        chunksize = max(1, len(texts) // (workers * 4))
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(terms, case_sensitive)) as pool:
+                return list(pool.map(_extract_in_worker, texts, chunksize=chunksize))
+        except (BrokenProcessPool, OSError) as e:
+            logger.warning(f"Parallel entity extraction failed, retrying in-process: {e}")
+
+    extractor = EntityExtractor(terms, case_sensitive)
+    return [extractor.extract(text) for text in texts]
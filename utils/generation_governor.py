@@ -0,0 +1,120 @@
+"""
+Per-mode generation governors - num_predict caps, stop sequences, <think> stripping and client-side early stop
+"""
+import os
+import re
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+SENTENCE_END = re.compile(r'[.!?]+["\')\]]*\s')
+THINK_BLOCK = re.compile(r'<think>.*?(</think>|$)', re.DOTALL)
+
+# Reasoning models spend most of num_predict inside <think>, so the caps leave room for it
+MODE_LIMITS = {
+    "inquiry": {"num_predict": 512, "max_sentences": 2, "max_words": 30},
+    "summary": {"num_predict": 768, "max_sentences": 4, "max_words": 90},
+    "contextual": {"num_predict": 640, "max_sentences": 3, "max_words": 50},
+}
+STOP_SEQUENCES = ["\nUser:", "User's message:"]  # The model starting to write the user's side of the chat
+
+
+def generation_options(mode, **options):
+    """Ollama ``options`` for ``mode``; NUM_PREDICT_<MODE> overrides the cap"""
+    limits = MODE_LIMITS[mode]
+    options.setdefault("num_predict", int(os.getenv(f"NUM_PREDICT_{mode.upper()}", limits["num_predict"])))
+    options.setdefault("stop", STOP_SEQUENCES)
+    return options
+
+
+def think_params():
+    """Extra request fields; OLLAMA_THINK=false asks thinking-capable models to skip reasoning"""
+    think = os.getenv("OLLAMA_THINK")
+    return {"think": think.lower() == "true"} if think else {}
+
+
+def strip_thinking(text):
+    """Remove <think>...</think> blocks (including an unterminated one) from a complete response"""
+    return THINK_BLOCK.sub("", text).strip()
+
+
+class StreamGovernor:
+    """Filters a token stream down to the visible answer and decides when it is complete
+
+    ``feed`` takes each raw token and returns the text to show, holding back anything
+    that might be the start of a ``<think>`` tag. Tokens inside ``<think>`` (or sent in
+    Ollama's separate ``thinking`` field) are counted but not shown. Once the visible
+    answer has ``max_sentences`` complete sentences, or runs past ``max_words`` by
+    half again at a sentence end, ``done`` is set and the caller can stop streaming.
+    """
+
+    def __init__(self, mode):
+        limits = MODE_LIMITS[mode]
+        self.max_sentences = limits["max_sentences"]
+        self.max_words = limits["max_words"]
+        self.thinking_tokens = 0
+        self.answer_tokens = 0
+        self.visible = ""
+        self.done = False
+        self._pending = ""
+        self._in_think = False
+
+    def feed_chunk(self, chunk):
+        """Feed one Ollama chunk and return the visible text it adds"""
+        if chunk.get("thinking"):
+            self.thinking_tokens += 1
+        return self.feed(chunk.get("response", ""))
+
+    def feed(self, token):
+        if self.done or not token:
+            return ""
+        was_thinking = self._in_think
+        self._pending += token
+        out = ""
+        while self._pending:
+            tag = THINK_CLOSE if self._in_think else THINK_OPEN
+            index = self._pending.find(tag)
+            if index >= 0:
+                if not self._in_think:
+                    out += self._pending[:index]
+                self._pending = self._pending[index + len(tag):]
+                self._in_think = not self._in_think
+                continue
+            # Keep a possible partial tag ("<thi") for the next token
+            keep = next((n for n in range(len(tag) - 1, 0, -1) if self._pending.endswith(tag[:n])), 0)
+            if not self._in_think:
+                out += self._pending[:len(self._pending) - keep]
+            self._pending = self._pending[len(self._pending) - keep:]
+            break
+        if (was_thinking or self._in_think or self._pending) and not out.strip():
+            self.thinking_tokens += 1
+        else:
+            self.answer_tokens += 1
+        return self._emit(out)
+
+    def _emit(self, text):
+        if not self.visible:
+            text = text.lstrip()  # Drop the blank lines that follow </think>
+        if not text:
+            return ""
+        shown = len(self.visible)
+        self.visible += text
+        ends = [m.end() for m in SENTENCE_END.finditer(self.visible)]
+        if len(ends) >= self.max_sentences:
+            cut = ends[self.max_sentences - 1]
+        elif ends and len(self.visible.split()) > self.max_words * 1.5:
+            cut = ends[-1]
+        else:
+            return text
+        # Drop whatever this token added past the sentence end; earlier text is already on screen
+        cut = max(cut, shown)
+        text = text[:cut - shown]
+        self.visible = self.visible[:cut]
+        self.done = True
+        return text
+
+    def finish(self):
+        """Flush text held back at the end of the stream"""
+        if self.done or self._in_think:
+            return ""
+        text, self._pending = self._pending, ""
+        return self._emit(text)
@@ -0,0 +1,240 @@
+"""
+LLM generation metrics - histograms of prompt size, prompt eval time, TTFT, tokens/sec, latency and queue wait
+"""
+import os
+import time
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = int(os.getenv("LLM_METRICS_PORT", "9464"))  # 0 disables the endpoint
+
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192)
+RATE_BUCKETS = (1, 5, 10, 20, 40, 80, 160)
+
+# name: (buckets, help text)
+METRICS = {
+    "prompt_tokens": (TOKEN_BUCKETS, "Prompt tokens evaluated per generation"),
+    "prompt_eval_seconds": (SECONDS_BUCKETS, "Time Ollama spent evaluating the prompt"),
+    "ttft_seconds": (SECONDS_BUCKETS, "Submission to first streamed token, including queue wait"),
+    "tokens_per_second": (RATE_BUCKETS, "Generated tokens per second of eval time"),
+    "latency_seconds": (SECONDS_BUCKETS, "Submission to final chunk, including queue wait"),
+    "queue_wait_seconds": (SECONDS_BUCKETS, "Time spent waiting for a scheduler slot"),
+    "thinking_tokens": (TOKEN_BUCKETS, "Reasoning-trace tokens streamed but not shown"),
+}
+
+# name: help text
+COUNTERS = {
+    "upstream_calls": "Ollama requests actually sent, per call type",
+    "coalesced_calls": "Requests served by joining an identical in-flight request",
+    "early_stops": "Generations closed before their done chunk (governor cap, cancellation)",
+}
+
+
+class Histogram:
+    """Fixed-bucket histogram with Prometheus semantics (cumulative ``le`` buckets)"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimate the q-th quantile by linear interpolation inside its bucket, like histogram_quantile"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for i, bucket_count in enumerate(self.counts):
+            if bucket_count and cumulative + bucket_count >= target:
+                if i == len(self.buckets):
+                    return self.buckets[-1]  # +Inf bucket has no upper bound to interpolate to
+                lower = self.buckets[i - 1] if i else 0.0
+                return round(lower + (self.buckets[i] - lower) * (target - cumulative) / bucket_count, 3)
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+
+class LLMMetrics:
+    """Thread-safe set of histograms and counters per metric and source (chat, hyde, summary, ...)"""
+
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, source, amount=1):
+        with self._lock:
+            self._counters[(name, source)] = self._counters.get((name, source), 0) + amount
+
+    def observe(self, name, source, value):
+        with self._lock:
+            key = (name, source)
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(METRICS[name][0])
+            self._histograms[key].observe(value)
+
+    def record_generation(self, source, done_chunk, submitted_at, first_token_at=None, started_at=None):
+        """Record one finished generation from its final ``done`` chunk and monotonic timestamps"""
+        now = time.monotonic()
+        self.observe("prompt_tokens", source, done_chunk.get("prompt_eval_count", 0))
+        self.observe("prompt_eval_seconds", source, done_chunk.get("prompt_eval_duration", 0) / 1e9)
+        eval_seconds = done_chunk.get("eval_duration", 0) / 1e9
+        if eval_seconds > 0:
+            self.observe("tokens_per_second", source, done_chunk.get("eval_count", 0) / eval_seconds)
+        if first_token_at is not None:
+            self.observe("ttft_seconds", source, first_token_at - submitted_at)
+        if started_at is not None:
+            self.observe("queue_wait_seconds", source, started_at - submitted_at)
+        self.observe("latency_seconds", source, now - submitted_at)
+
+    def record_early_stop(self, source, submitted_at, first_token_at=None, started_at=None, tokens=0):
+        """Record a generation closed before its ``done`` chunk from what was seen up to that point
+
+        Ollama's own counters only arrive with the done chunk, so tokens/sec is taken
+        from the streamed chunks (one token each) over the time since the first one.
+        """
+        now = time.monotonic()
+        self.increment("early_stops", source)
+        if first_token_at is not None:
+            self.observe("ttft_seconds", source, first_token_at - submitted_at)
+            if tokens > 1 and now > first_token_at:
+                self.observe("tokens_per_second", source, (tokens - 1) / (now - first_token_at))
+        if started_at is not None:
+            self.observe("queue_wait_seconds", source, started_at - submitted_at)
+        self.observe("latency_seconds", source, now - submitted_at)
+
+    def snapshot(self):
+        """{source: {metric: {count, mean, p50, p95} or counter value}} for the UI"""
+        with self._lock:
+            items = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+        summary = {}
+        for (name, source), value in counters:
+            summary.setdefault(source, {})[name] = value
+        for (name, source), histogram in items:
+            summary.setdefault(source, {})[name] = {
+                "count": histogram.count,
+                "mean": round(histogram.sum / histogram.count, 3) if histogram.count else 0.0,
+                "p50": histogram.quantile(0.5),
+                "p95": histogram.quantile(0.95),
+            }
+        return summary
+
+    def render_prometheus(self):
+        """Prometheus text exposition of every histogram"""
+        with self._lock:
+            items = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+        lines = []
+        for name, help_text in COUNTERS.items():
+            series = [(source, value) for (metric, source), value in counters if metric == name]
+            if not series:
+                continue
+            lines.append(f"# HELP llm_{name}_total {help_text}")
+            lines.append(f"# TYPE llm_{name}_total counter")
+            for source, value in series:
+                lines.append(f'llm_{name}_total{{source="{source}"}} {value}')
+        for name, (_, help_text) in METRICS.items():
+            series = [(source, histogram) for (metric, source), histogram in items if metric == name]
+            if not series:
+                continue
+            lines.append(f"# HELP llm_{name} {help_text}")
+            lines.append(f"# TYPE llm_{name} histogram")
+            for source, histogram in series:
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f'llm_{name}_bucket{{source="{source}",le="{bound}"}} {cumulative}')
+                lines.append(f'llm_{name}_sum{{source="{source}"}} {histogram.sum}')
+                lines.append(f'llm_{name}_count{{source="{source}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+
+def observe_generation(chunks, job, metrics=None):
+    """Pass Ollama chunks through unchanged, recording metrics when the ``done`` chunk arrives
+
+    If the consumer closes the stream first (the governor stopped it or the job was
+    cancelled), what was observed so far is recorded as an early stop instead, so
+    capped generations still count towards the latency histograms.
+    """
+    metrics = metrics or get_llm_metrics()
+    first_token_at = None
+    tokens = 0
+    try:
+        for chunk in chunks:
+            if chunk.get("response"):
+                tokens += 1
+                if first_token_at is None:
+                    first_token_at = time.monotonic()
+            if chunk.get("done"):
+                # A non-streamed response arrives all at once in the done chunk, so it has no first token
+                streamed = not chunk.get("response")
+                metrics.record_generation(job.source, chunk, job.submitted_at,
+                                          first_token_at if streamed else None, job.started_at)
+            yield chunk
+    except GeneratorExit:
+        metrics.record_early_stop(job.source, job.submitted_at, first_token_at, job.started_at, tokens)
+        raise
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = get_llm_metrics().render_prometheus(), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body, content_type = json.dumps(get_llm_metrics().snapshot()), "application/json"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+_metrics = LLMMetrics()
+_server = None
+_server_lock = threading.Lock()
+
+
+def get_llm_metrics():
+    """Return the process-wide metrics registry"""
+    return _metrics
+
+
+def start_metrics_server(port=None, host="127.0.0.1"):
+    """Serve /metrics (Prometheus) and /metrics.json once per process; returns the port or None"""
+    global _server
+    port = METRICS_PORT if port is None else port
+    with _server_lock:
+        if _server is None and port:
+            try:
+                _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError as e:
+                logger.warning(f"LLM metrics endpoint not started on port {port}: {e}")
+                return None
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="LLMMetrics", daemon=True).start()
+            logger.info(f"LLM metrics available at http://{host}:{_server.server_address[1]}/metrics")
+        return _server.server_address[1] if _server else None
@@ -0,0 +1,281 @@
+"""
+Asyncio-based scheduler in front of the Ollama API - bounded concurrency, priority lanes and cancellation
+"""
+import os
+import time
+import queue
+import asyncio
+import logging
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.llm_metrics import observe_generation
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes, lower runs first
+INTERACTIVE = 0
+HYDE = 1
+BACKGROUND = 2
+LANE_NAMES = {INTERACTIVE: "interactive", HYDE: "hyde", BACKGROUND: "background"}
+SESSION_SWEEP_INTERVAL = float(os.getenv("LLM_SESSION_SWEEP_INTERVAL", "5"))  # Seconds between disconnect checks
+
+_DONE = object()
+
+
+class GenerationCancelled(Exception):
+    """Raised by ``LLMJob.result`` when the job was cancelled before it finished"""
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+class LLMJob:
+    """One queued LLM call; ``work`` is a zero-argument callable returning an iterable of results"""
+
+    def __init__(self, work, priority=INTERACTIVE, session_id=None, source=None):
+        self.work = work
+        self.priority = priority
+        self.session_id = session_id
+        self.source = source  # Metrics label; set for Ollama generations, whose chunks are observed
+        self.cancel_event = threading.Event()
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self._output = queue.Queue()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    @property
+    def queue_wait(self):
+        """Seconds spent waiting for a slot (so far, if still queued)"""
+        return (self.started_at or time.monotonic()) - self.submitted_at
+
+    def cancel(self):
+        """Cancel the job; queued jobs never run and in-flight streams are closed at the next chunk"""
+        if not self.cancel_event.is_set():
+            self.cancel_event.set()
+            self._output.put(_DONE)
+
+    def stream(self):
+        """Yield results as the worker produces them; closing this generator cancels the job"""
+        try:
+            while True:
+                item = self._output.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.error
+                yield item
+        finally:
+            self.cancel()  # No-op if the job already finished
+
+    def result(self):
+        """Block until the job finishes and return its last result"""
+        last = None
+        for last in self.stream():
+            pass
+        if self.cancelled and self.finished_at is None:
+            raise GenerationCancelled("LLM job was cancelled")
+        return last
+
+
+class LLMScheduler:
+    """Runs LLM jobs on an asyncio loop in a background thread
+
+    At most ``max_concurrency`` jobs talk to Ollama at once; waiting jobs are taken
+    from an ``asyncio.PriorityQueue`` so interactive chat always goes ahead of HyDE
+    and background work. The blocking HTTP streaming itself runs in a thread pool of
+    the same size, checking the job's cancel flag between chunks.
+    """
+
+    def __init__(self, max_concurrency=None):
+        self.max_concurrency = max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", "2"))
+        self._sequence = itertools.count()
+        self._jobs = set()
+        self._jobs_lock = threading.Lock()
+        self._queued = {lane: 0 for lane in LANE_NAMES}
+        self._in_flight = 0
+        self._completed = 0
+        self._cancelled = 0
+        self._waits = {lane: deque(maxlen=200) for lane in LANE_NAMES}
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="LLMWorker")
+        self._session_alive = None  # Optional predicate; jobs of sessions it rejects are cancelled
+
+        self._ready = threading.Event()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="LLMScheduler", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.PriorityQueue()
+        self._workers = [self._loop.create_task(self._worker()) for _ in range(self.max_concurrency)]
+        self._workers.append(self._loop.create_task(self._sweep_sessions()))
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            with self._jobs_lock:
+                self._queued[job.priority] -= 1
+            if job.cancelled:
+                self._finish(job)
+                continue
+            job.started_at = time.monotonic()
+            self._waits[job.priority].append(job.queue_wait)
+            with self._jobs_lock:
+                self._in_flight += 1
+            try:
+                await self._loop.run_in_executor(self._executor, self._execute, job)
+            finally:
+                with self._jobs_lock:
+                    self._in_flight -= 1
+                self._finish(job)
+
+    async def _sweep_sessions(self):
+        """Cancel the jobs of sessions that went away without closing their streams"""
+        while True:
+            await asyncio.sleep(SESSION_SWEEP_INTERVAL)
+            if self._session_alive is None:
+                continue
+            with self._jobs_lock:
+                sessions = {job.session_id for job in self._jobs if job.session_id is not None}
+            for session_id in sessions:
+                try:
+                    alive = self._session_alive(session_id)
+                except Exception as e:
+                    logger.debug(f"Session check failed for {session_id}: {e}")
+                    continue
+                if not alive:
+                    self.cancel_session(session_id)
+
+    @staticmethod
+    def _execute(job):
+        """Drain the job's iterable on a worker thread, stopping early if it is cancelled"""
+        iterator = None
+        try:
+            iterator = iter(job.work())  # Non-streaming work runs (and may raise) right here
+            if job.source is not None:
+                iterator = observe_generation(iterator, job)
+            for item in iterator:
+                if job.cancelled:
+                    break
+                job._output.put(item)
+        except Exception as e:
+            job._output.put(_Failure(e))
+        finally:
+            close = getattr(iterator, "close", None)
+            if close:
+                close()  # Closes the HTTP response, which makes Ollama stop generating
+            if not job.cancelled:
+                job.finished_at = time.monotonic()
+            job._output.put(_DONE)
+
+    def _finish(self, job):
+        with self._jobs_lock:
+            self._jobs.discard(job)
+            if job.cancelled and job.finished_at is None:
+                self._cancelled += 1
+            else:
+                self._completed += 1
+
+    def submit(self, work, priority=INTERACTIVE, session_id=None, source=None):
+        """Queue ``work`` and return its ``LLMJob``"""
+        job = LLMJob(work, priority, session_id, source)
+        with self._jobs_lock:
+            self._jobs.add(job)
+            self._queued[priority] += 1
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, (priority, next(self._sequence), job))
+        return job
+
+    def cancel_session(self, session_id):
+        """Cancel every queued or in-flight job that belongs to ``session_id``"""
+        with self._jobs_lock:
+            jobs = [job for job in self._jobs if job.session_id == session_id]
+        for job in jobs:
+            job.cancel()
+        if jobs:
+            logger.info(f"Cancelled {len(jobs)} LLM job(s) for session {session_id}")
+        return len(jobs)
+
+    def set_session_check(self, session_alive):
+        """Cancel the jobs of any session for which ``session_alive(session_id)`` turns false
+
+        Checked every SESSION_SWEEP_INTERVAL seconds, so a browser tab that closes
+        mid-generation doesn't keep its queued or running jobs holding a lane.
+        """
+        self._session_alive = session_alive
+
+    def stream_generate(self, client, prompt, model, options=None, priority=INTERACTIVE, session_id=None,
+                        source=None, **params):
+        """Queue a streaming generation; iterate ``job.stream()`` for the Ollama chunks
+
+        ``source`` labels the generation's metrics and defaults to the lane name.
+        """
+        return self.submit(lambda: client.generate_stream(prompt, model, options=options, **params),
+                           priority, session_id, source or LANE_NAMES[priority])
+
+    def generate(self, client, prompt, model, options=None, priority=INTERACTIVE, session_id=None,
+                 source=None, **params):
+        """Queue a non-streaming generation and block until its response JSON is available"""
+        job = self.submit(lambda: [client.generate(prompt, model, options=options, **params)],
+                          priority, session_id, source or LANE_NAMES[priority])
+        return job.result()
+
+    def metrics(self):
+        """Snapshot of queue depth per lane, in-flight jobs and recent queue waits"""
+        with self._jobs_lock:
+            snapshot = {
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self._in_flight,
+                "completed": self._completed,
+                "cancelled": self._cancelled,
+                "queued": {LANE_NAMES[lane]: depth for lane, depth in self._queued.items()},
+            }
+        snapshot["avg_wait_s"] = {
+            LANE_NAMES[lane]: round(sum(waits) / len(waits), 3) if waits else 0.0
+            for lane, waits in self._waits.items()
+        }
+        return snapshot
+
+    def shutdown(self):
+        """Cancel outstanding jobs and the worker tasks, then stop the loop"""
+        with self._jobs_lock:
+            jobs = list(self._jobs)
+        for job in jobs:
+            job.cancel()
+        self._loop.call_soon_threadsafe(self._stop_loop)
+        self._thread.join(timeout=5)
+        self._executor.shutdown(wait=False)
+
+    def _stop_loop(self):
+        # Cancelled workers (and the session sweep) need one more pass of the loop to finish before it stops
+        for worker in self._workers:
+            worker.cancel()
+        self._loop.create_task(self._await_workers())
+
+    async def _await_workers(self):
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._loop.stop()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Return the process-wide scheduler shared by every Streamlit session"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler()
+        return _scheduler
@@ -0,0 +1,246 @@
+"""
+Self-contained mock Ollama server for deterministic load and latency testing
+
+Serves /api/generate (streaming and non-streaming), /api/embed, /api/embeddings,
+/api/tags and /api/version with configurable time-to-first-token, token rate and
+error injection. Outputs are derived from a hash of the request, so the same
+request always gets the same answer. Point the app at it with
+OLLAMA_API_URL=http://127.0.0.1:11435.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import hashlib
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+VOCABULARY = (
+    "adventurer chocobo crystal jeuno bastok windurst sandoria party level experience "
+    "mage warrior thief paladin ninja spell ability weapon armor quest mission zone "
+    "monster notorious drop linkshell gil auction airship merit limit break job"
+).split()
+
+
+class MockConfig:
+    """Behaviour knobs for the mock server"""
+
+    def __init__(self, ttft=0.2, tokens_per_second=50.0, num_tokens=40, error_rate=0.0,
+                 embedding_dim=768, models=None, think=False, seed=0):
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.num_tokens = num_tokens
+        self.error_rate = error_rate
+        self.embedding_dim = embedding_dim
+        self.models = models or [os.getenv("MODEL", "deepseek-r1:7b"), "nomic-embed-text:latest"]
+        self.think = think  # Wrap the first tokens in <think></think> like deepseek-r1
+        self._errors = random.Random(seed)
+        self._errors_lock = threading.Lock()
+
+    def should_fail(self):
+        with self._errors_lock:
+            return self._errors.random() < self.error_rate
+
+
+def _rng_for(*parts):
+    digest = hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8")).digest()
+    return random.Random(int.from_bytes(digest[:8], "big"))
+
+
+def generate_tokens(config, model, prompt, num_predict=None):
+    """Deterministic token list for a prompt"""
+    rng = _rng_for(model, prompt)
+    count = config.num_tokens if not num_predict or num_predict < 0 else min(config.num_tokens, num_predict)
+    tokens = [rng.choice(VOCABULARY) + " " for _ in range(count)]
+    if config.think and tokens:
+        split = max(1, len(tokens) // 3)
+        tokens = ["<think>"] + tokens[:split] + ["</think>\n\n"] + tokens[split:]
+    return tokens
+
+
+def embed_text(config, model, text):
+    """Deterministic unit-length embedding"""
+    rng = _rng_for(model, text)
+    vector = [rng.gauss(0.0, 1.0) for _ in range(config.embedding_dim)]
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+class MockOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real server
+    config = MockConfig()
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionResetError:
+            pass  # Client dropped a keep-alive connection, e.g. after cancelling a stream
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, payload):
+        data = (json.dumps(payload) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _check_model(self, model):
+        if model not in self.config.models:
+            self._send_json({"error": f"model '{model}' not found"}, status=404)
+            return False
+        return True
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": name, "model": name} for name in self.config.models]})
+        elif self.path == "/api/version":
+            self._send_json({"version": "0.0.0-mock"})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        try:
+            request = self._read_json()
+        except json.JSONDecodeError:
+            self._send_json({"error": "invalid JSON"}, status=400)
+            return
+
+        if self.config.should_fail():
+            self._send_json({"error": "injected failure"}, status=500)
+            return
+
+        if self.path == "/api/generate":
+            self._generate(request)
+        elif self.path == "/api/embed":
+            if self._check_model(request.get("model")):
+                inputs = request.get("input", [])
+                inputs = [inputs] if isinstance(inputs, str) else inputs
+                self._send_json({
+                    "model": request["model"],
+                    "embeddings": [embed_text(self.config, request["model"], text) for text in inputs]
+                })
+        elif self.path == "/api/embeddings":
+            if self._check_model(request.get("model")):
+                self._send_json({"embedding": embed_text(self.config, request["model"], request.get("prompt", ""))})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def _generate(self, request):
+        model = request.get("model")
+        if not self._check_model(model):
+            return
+        prompt = request.get("prompt", "")
+        context = request.get("context") or []
+        options = request.get("options") or {}
+        started = time.perf_counter()
+
+        # An empty prompt only loads the model, like the real API
+        tokens = generate_tokens(self.config, model, prompt, options.get("num_predict")) if prompt else []
+        prompt_tokens = len(prompt.split()) + len(request.get("system", "").split())
+        final = {
+            "model": model,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "response": "",
+            "done": True,
+            "done_reason": "stop" if prompt else "load",
+            "context": context + list(range(len(context), len(context) + prompt_tokens + len(tokens))),
+            "load_duration": 0,
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(self.config.ttft * 1e9),
+            "eval_count": len(tokens),
+        }
+
+        delay = 1.0 / self.config.tokens_per_second if self.config.tokens_per_second > 0 else 0.0
+        if tokens:
+            time.sleep(self.config.ttft)
+        eval_started = time.perf_counter()
+
+        if request.get("stream", True):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for token in tokens:
+                    self._write_chunk({"model": model, "response": token, "done": False})
+                    time.sleep(delay)
+                final["eval_duration"] = int((time.perf_counter() - eval_started) * 1e9)
+                final["total_duration"] = int((time.perf_counter() - started) * 1e9)
+                self._write_chunk(final)
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                logger.info("Client closed the stream, generation aborted")
+            return
+
+        time.sleep(delay * len(tokens))
+        final["response"] = "".join(tokens)
+        final["eval_duration"] = int((time.perf_counter() - eval_started) * 1e9)
+        final["total_duration"] = int((time.perf_counter() - started) * 1e9)
+        self._send_json(final)
+
+
+def start_mock_server(host="127.0.0.1", port=11435, config=None):
+    """Start the mock server on a background thread and return it; call ``shutdown()`` to stop"""
+    handler = type("ConfiguredMockOllamaHandler", (MockOllamaHandler,), {"config": config or MockConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="MockOllama", daemon=True)
+    thread.start()
+    logger.info(f"Mock Ollama listening on http://{host}:{server.server_address[1]}")
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a mock Ollama server for load and latency testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.getenv("MOCK_OLLAMA_PORT", "11435")))
+    parser.add_argument("--ttft", type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="Generated tokens per second")
+    parser.add_argument("--tokens", type=int, default=40, help="Tokens per response (capped by num_predict)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    parser.add_argument("--embedding-dim", type=int, default=768)
+    parser.add_argument("--models", nargs="+", help="Installed model names reported by /api/tags")
+    parser.add_argument("--think", action="store_true", help="Emit a <think> section like deepseek-r1")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for error injection")
+    args = parser.parse_args()
+
+    config = MockConfig(
+        ttft=args.ttft,
+        tokens_per_second=args.token_rate,
+        num_tokens=args.tokens,
+        error_rate=args.error_rate,
+        embedding_dim=args.embedding_dim,
+        models=args.models,
+        think=args.think,
+        seed=args.seed
+    )
+    server = start_mock_server(args.host, args.port, config)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
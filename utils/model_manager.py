@@ -0,0 +1,119 @@
+"""
+Model lifecycle manager - preloads the chat and embedding models at startup and keeps them resident in Ollama
+"""
+import os
+import time
+import logging
+import threading
+
+from utils.ollama_client import get_ollama_client
+from utils.llm_scheduler import get_scheduler, BACKGROUND
+from utils.conversation_context import KEEP_ALIVE
+
+logger = logging.getLogger(__name__)
+
+KEEPALIVE_INTERVAL = float(os.getenv("OLLAMA_KEEPALIVE_INTERVAL", "300"))  # Seconds between pings, 0 disables them
+
+
+class ModelManager:
+    """Loads each model once in the background, then pings it every ``interval`` seconds
+
+    A generation model is loaded by an empty /api/generate request and an embedding
+    model by embedding a single short string; both carry ``keep_alive`` so Ollama
+    keeps the weights in memory for that long after the last request. Pings must
+    therefore come more often than ``keep_alive`` expires.
+    """
+
+    def __init__(self, base_url=None, models=None, interval=None, keep_alive=None):
+        self.client = get_ollama_client(base_url)
+        self.models = models or {}  # {model name: "generate" | "embed"}
+        self.interval = KEEPALIVE_INTERVAL if interval is None else interval
+        self.keep_alive = keep_alive or KEEP_ALIVE
+        self.status = {
+            name: {"kind": kind, "state": "pending", "load_s": None, "last_ping": None, "error": None}
+            for name, kind in self.models.items()
+        }
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the warm-up thread; safe to call on every Streamlit rerun"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ModelManager", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        for name in self.models:
+            self.warm(name, initial=True)
+        while self.interval > 0 and not self._stop.wait(self.interval):
+            for name in self.models:
+                self.warm(name)
+
+    def _load(self, name, kind):
+        if kind == "embed":
+            self.client.embed(["warm-up"], name, keep_alive=self.keep_alive)
+        else:
+            # An empty prompt loads the model without generating anything
+            get_scheduler().generate(self.client, "", name, priority=BACKGROUND, source="warmup",
+                                    keep_alive=self.keep_alive)
+
+    def warm(self, name, initial=False):
+        """Load or refresh ``name`` and record how long it took"""
+        kind = self.models[name]
+        if initial:
+            self._update(name, state="loading")
+        started = time.perf_counter()
+        try:
+            self._load(name, kind)
+        except Exception as e:
+            logger.warning(f"Warm-up of {name} failed: {e}")
+            self._update(name, state="error", error=str(e))
+            return False
+        elapsed = round(time.perf_counter() - started, 2)
+        changes = {"state": "ready", "last_ping": time.strftime("%H:%M:%S"), "error": None}
+        if initial or self.status[name]["state"] != "ready":
+            changes["load_s"] = elapsed
+            logger.info(f"{name} loaded in {elapsed}s")
+        self._update(name, **changes)
+        return True
+
+    def _update(self, name, **changes):
+        with self._lock:
+            self.status[name].update(changes)
+
+    def snapshot(self):
+        """Copy of the per-model state for the UI"""
+        with self._lock:
+            return {name: dict(info) for name, info in self.status.items()}
+
+    @property
+    def ready(self):
+        with self._lock:
+            return all(info["state"] == "ready" for info in self.status.values())
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_model_manager(base_url=None, model=None, embeddings_model=None, extra_models=()):
+    """Return the process-wide manager, starting it on the first call
+
+    ``extra_models`` are further generation models to keep warm, e.g. per-task routes.
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            models = {}
+            for name in [model, *extra_models]:
+                if name:
+                    models[name] = "generate"
+            if embeddings_model:
+                models[embeddings_model] = "embed"
+            _manager = ModelManager(base_url, models).start()
+        return _manager
@@ -0,0 +1,123 @@
+"""
+Per-task model routing - cheaper models for HyDE and inquiry turns, automatic fallback and per-route stats
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+
+from utils.ollama_client import get_ollama_client
+
+logger = logging.getLogger(__name__)
+
+TASKS = ("hyde", "inquiry", "summary", "contextual")
+INSTALLED_TTL = 60  # Seconds to trust the /api/tags listing
+
+
+def normalize_model(name):
+    """Ollama reports untagged models as ``name:latest``"""
+    return name if ":" in name else f"{name}:latest"
+
+
+class ModelRouter:
+    """Chooses the model for each task and keeps latency and quality stats per route
+
+    ``MODEL_HYDE``, ``MODEL_INQUIRY``, ``MODEL_SUMMARY`` and ``MODEL_CONTEXTUAL``
+    override the default model for their task. A routed model that isn't installed
+    (per /api/tags, or after a 404) falls back to the default model. Quality is a
+    number in [0, 1] reported by the caller, e.g. whether a chat turn got a real answer
+    or the best reranker score of the documents a HyDE expansion retrieved.
+    """
+
+    def __init__(self, default_model, base_url=None, routes=None):
+        self.client = get_ollama_client(base_url)
+        self.default_model = default_model
+        self.routes = routes if routes is not None else {
+            task: os.getenv(f"MODEL_{task.upper()}") or default_model for task in TASKS
+        }
+        self._installed = None
+        self._installed_at = 0.0
+        self._missing = set()
+        self._warned = set()
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _is_installed(self, model):
+        if normalize_model(model) in self._missing:
+            return False
+        if self._installed is None or time.monotonic() - self._installed_at > INSTALLED_TTL:
+            try:
+                self._installed = {normalize_model(name) for name in self.client.list_models()}
+                self._installed_at = time.monotonic()
+            except Exception as e:
+                logger.debug(f"Could not list Ollama models: {e}")
+                return True  # Can't tell; let the call itself succeed or fail
+        return normalize_model(model) in self._installed
+
+    def model_for(self, task):
+        """Model to use for ``task``"""
+        model = self.routes.get(task, self.default_model)
+        if model != self.default_model and not self._is_installed(model):
+            if (task, model) not in self._warned:
+                self._warned.add((task, model))
+                logger.warning(f"Model {model} for {task} is not available, falling back to {self.default_model}")
+            return self.default_model
+        return model
+
+    def mark_missing(self, model):
+        """Call after Ollama answered 404 for ``model`` so later calls fall back"""
+        with self._lock:
+            self._missing.add(normalize_model(model))
+
+    def record(self, task, model, latency, ok=True, quality=None):
+        """Record one routed call"""
+        with self._lock:
+            stats = self._stats.setdefault((task, model), {
+                "calls": 0, "errors": 0, "latencies": deque(maxlen=200), "quality": deque(maxlen=200)
+            })
+            stats["calls"] += 1
+            if not ok:
+                stats["errors"] += 1
+            stats["latencies"].append(latency)
+            if quality is not None:
+                stats["quality"].append(quality)
+
+    def record_quality(self, task, model, quality):
+        """Attach a quality score to a route after the fact (e.g. once retrieval has been reranked)"""
+        with self._lock:
+            if (task, model) in self._stats:
+                self._stats[(task, model)]["quality"].append(quality)
+
+    def snapshot(self):
+        """{task: {model, configured, calls, errors, avg/p95 latency, avg quality}} for the UI"""
+        with self._lock:
+            stats = {
+                key: {**value, "latencies": list(value["latencies"]), "quality": list(value["quality"])}
+                for key, value in self._stats.items()
+            }
+        report = {}
+        for (task, model), value in sorted(stats.items()):
+            latencies = sorted(value["latencies"])
+            report.setdefault(task, {"configured": self.routes.get(task, self.default_model), "models": {}})
+            report[task]["models"][model] = {
+                "calls": value["calls"],
+                "errors": value["errors"],
+                "avg_latency_s": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+                "p95_latency_s": round(latencies[int(0.95 * (len(latencies) - 1))], 2) if latencies else 0.0,
+                "avg_quality": round(sum(value["quality"]) / len(value["quality"]), 3) if value["quality"] else None,
+            }
+        return report
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_model_router(default_model=None, base_url=None):
+    """Return the process-wide router; ``default_model`` defaults to the MODEL environment variable"""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter(default_model or os.getenv("MODEL", "deepseek-r1:7b"), base_url)
+        return _router
@@ -0,0 +1,84 @@
+"""
+Load generator for the Ollama path - concurrent streamed generations through the shared client and scheduler
+
+Run against the mock server (utils/mock_ollama.py) for repeatable numbers:
+    python -m utils.ollama_bench --url http://127.0.0.1:11435 --requests 20 --concurrency 4
+"""
+import time
+import json
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.ollama_client import OllamaClient
+from utils.llm_scheduler import LLMScheduler, INTERACTIVE
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_one(scheduler, client, model, prompt):
+    """Stream one generation and return (ttft, total, tokens, queue_wait) in seconds"""
+    started = time.perf_counter()
+    job = scheduler.stream_generate(client, prompt, model, priority=INTERACTIVE)
+    ttft = None
+    tokens = 0
+    for chunk in job.stream():
+        if chunk.get("response"):
+            tokens += 1
+            if ttft is None:
+                ttft = time.perf_counter() - started
+    return ttft or 0.0, time.perf_counter() - started, tokens, job.queue_wait
+
+
+def run_bench(url, model, requests, concurrency, scheduler_slots=None):
+    client = OllamaClient(url)
+    scheduler = LLMScheduler(max_concurrency=scheduler_slots or concurrency)
+    started = time.perf_counter()
+    errors = 0
+    results = []
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(run_one, scheduler, client, model, f"Benchmark prompt {i}") for i in range(requests)]
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception:
+                errors += 1
+    elapsed = time.perf_counter() - started
+    scheduler.shutdown()
+
+    ttfts = [r[0] for r in results]
+    totals = [r[1] for r in results]
+    tokens = sum(r[2] for r in results)
+    waits = [r[3] for r in results]
+    return {
+        "requests": requests,
+        "errors": errors,
+        "wall_s": round(elapsed, 3),
+        "throughput_tok_s": round(tokens / elapsed, 1) if elapsed else 0.0,
+        "ttft_p50_s": round(percentile(ttfts, 50), 3),
+        "ttft_p95_s": round(percentile(ttfts, 95), 3),
+        "latency_p50_s": round(percentile(totals, 50), 3),
+        "latency_p95_s": round(percentile(totals, 95), 3),
+        "queue_wait_avg_s": round(statistics.mean(waits), 3) if waits else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark streamed generations against an Ollama endpoint")
+    parser.add_argument("--url", default="http://127.0.0.1:11435")
+    parser.add_argument("--model", default="deepseek-r1:7b")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent callers")
+    parser.add_argument("--slots", type=int, help="Scheduler concurrency (defaults to --concurrency)")
+    args = parser.parse_args()
+    print(json.dumps(run_bench(args.url, args.model, args.requests, args.concurrency, args.slots), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+Shared Ollama HTTP client - pooled keep-alive session, timeouts, retries with jitter and a circuit breaker
+"""
+import os
+import json
+import time
+import random
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from langchain_core.embeddings import Embeddings
+
+from utils.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = "http://localhost:11434"
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised when the circuit breaker is open and calls are being short-circuited"""
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures and lets one trial call through after ``reset_timeout``"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.state = "closed"
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a call may proceed"""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"  # Let exactly one trial request through
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.state = "closed"
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning(f"Ollama circuit breaker opened after {self.failures} failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+class OllamaClient:
+    """Client for the Ollama REST API that every Ollama call in the app goes through
+
+    One ``requests.Session`` with a connection pool keeps TCP connections alive
+    between calls. Connection errors, timeouts and 5xx responses are retried with
+    exponential backoff and jitter, and count towards the circuit breaker; once it
+    opens, calls fail fast with ``CircuitOpenError`` instead of blocking the UI.
+    Identical concurrent generate/embed requests share one upstream call unless
+    OLLAMA_SINGLE_FLIGHT=0.
+    """
+
+    def __init__(self, base_url=None, connect_timeout=None, read_timeout=None, max_retries=None,
+                 backoff=None, pool_size=None, breaker=None):
+        self.base_url = (base_url or os.getenv("OLLAMA_API_URL", DEFAULT_BASE_URL)).rstrip("/")
+        self.connect_timeout = connect_timeout or float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "3.05"))
+        # For streams this is the longest allowed gap between chunks, not the total generation time
+        self.read_timeout = read_timeout or float(os.getenv("OLLAMA_READ_TIMEOUT", "120"))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("OLLAMA_MAX_RETRIES", "2"))
+        self.backoff = backoff or float(os.getenv("OLLAMA_RETRY_BACKOFF", "0.5"))
+        pool_size = pool_size or int(os.getenv("OLLAMA_POOL_SIZE", "10"))
+        self.breaker = breaker or CircuitBreaker(
+            failure_threshold=int(os.getenv("OLLAMA_BREAKER_THRESHOLD", "5")),
+            reset_timeout=float(os.getenv("OLLAMA_BREAKER_RESET", "30"))
+        )
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.single_flight = os.getenv("OLLAMA_SINGLE_FLIGHT", "1") != "0"
+        self._flights = {kind: SingleFlight(kind) for kind in ("generate", "generate_stream", "embed")}
+
+    def _coalesced(self, kind, payload, fn):
+        """Run ``fn`` through the single-flight group for identical ``payload``s"""
+        if not self.single_flight:
+            return fn()
+        return self._flights[kind].do(json.dumps(payload, sort_keys=True), fn)
+
+    def _request(self, method, path, payload=None, stream=False, timeout=None):
+        """Send a request with retries; returns the open ``requests.Response``"""
+        url = f"{self.base_url}{path}"
+        timeout = timeout or (self.connect_timeout, self.read_timeout)
+        last_error = None
+
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                raise CircuitOpenError(f"Ollama at {self.base_url} is unavailable (circuit open)")
+            try:
+                response = self.session.request(method, url, json=payload, stream=stream, timeout=timeout)
+                if response.status_code >= 500:
+                    response.close()
+                    raise requests.HTTPError(f"{response.status_code} Server Error for {url}", response=response)
+                self.breaker.record_success()
+                response.raise_for_status()  # 4xx (e.g. unknown model) is the caller's problem, not retried
+                return response
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+                if isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code < 500:
+                    raise
+                self.breaker.record_failure()
+                last_error = e
+                if attempt < self.max_retries:
+                    delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+                    logger.warning(f"Ollama request to {path} failed ({e}), retrying in {delay:.2f}s")
+                    time.sleep(delay)
+        raise last_error
+
+    def generate(self, prompt, model, options=None, **params):
+        """Non-streaming /api/generate; returns the response JSON"""
+        payload = {"model": model, "prompt": prompt, "stream": False, **params}
+        if options:
+            payload["options"] = options
+        return self._coalesced("generate", payload, lambda: self._request("POST", "/api/generate", payload).json())
+
+    def generate_stream(self, prompt, model, options=None, **params):
+        """Streaming /api/generate; returns an iterator of JSON chunks, shared with identical in-flight streams"""
+        payload = {"model": model, "prompt": prompt, "stream": True, **params}
+        if options:
+            payload["options"] = options
+        if not self.single_flight:
+            return self._stream(payload)
+        return self._flights["generate_stream"].stream(json.dumps(payload, sort_keys=True),
+                                                       lambda: self._stream(payload))
+
+    def _stream(self, payload):
+        """Yield each chunk of a streaming /api/generate and close the connection when done"""
+        response = self._request("POST", "/api/generate", payload, stream=True)
+        try:
+            # Read to the end of the body rather than stopping at "done" so the connection goes back to the pool
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line.decode())
+                if chunk.get("error"):
+                    raise RuntimeError(chunk["error"])
+                yield chunk
+        finally:
+            response.close()
+
+    def embed(self, texts, model, **params):
+        """Embed a list of texts; identical concurrent batches share one request"""
+        texts = list(texts)
+        return self._coalesced("embed", {"model": model, "input": texts, **params},
+                               lambda: self._embed(texts, model, **params))
+
+    def _embed(self, texts, model, **params):
+        """Uses /api/embed and falls back to the older /api/embeddings"""
+        try:
+            response = self._request("POST", "/api/embed", {"model": model, "input": list(texts), **params})
+            return response.json()["embeddings"]
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                raise
+        return [
+            self._request("POST", "/api/embeddings", {"model": model, "prompt": text, **params}).json()["embedding"]
+            for text in texts
+        ]
+
+    def list_models(self):
+        """Return the names of the models installed on the server"""
+        response = self._request("GET", "/api/tags", timeout=(self.connect_timeout, 10))
+        return [model["name"] for model in response.json().get("models", [])]
+
+
+class OllamaClientEmbeddings(Embeddings):
+    """LangChain embeddings backed by the shared client, so document ingestion uses the same pool"""
+
+    def __init__(self, model, base_url=None):
+        self.model = model
+        self.client = get_ollama_client(base_url)
+
+    def embed_documents(self, texts):
+        return self.client.embed(texts, self.model)
+
+    def embed_query(self, text):
+        return self.client.embed([text], self.model)[0]
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_ollama_client(base_url=None):
+    """Return the process-wide client for ``base_url`` (defaults to OLLAMA_API_URL)"""
+    base_url = (base_url or os.getenv("OLLAMA_API_URL", DEFAULT_BASE_URL)).rstrip("/")
+    with _clients_lock:
+        if base_url not in _clients:
+            _clients[base_url] = OllamaClient(base_url)
+        return _clients[base_url]
@@ -0,0 +1,166 @@
+"""
+Token-budgeted prompt assembly - packs the turn, database context, retrieved chunks and chat history into num_ctx
+"""
+import os
+import math
+import logging
+
+from utils.llm_scheduler import get_scheduler, BACKGROUND
+from utils.generation_governor import strip_thinking
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 3.5  # Errs on the high side for English BPE tokenizers, so estimates overflow less
+ANSWER_TOKENS = int(os.getenv("PROMPT_ANSWER_TOKENS", "512"))  # Kept free for the model's reply
+CONTEXT_TOKENS = 400  # Cap per retrieved chunk so one long chunk can't crowd out the rest
+SUMMARY_KEEP_MESSAGES = int(os.getenv("SUMMARY_KEEP_MESSAGES", "6"))  # Newest messages never folded into the summary
+SUMMARY_BATCH = 4  # Re-summarize once this many messages have aged out
+SUMMARY_MESSAGE_TOKENS = 300
+SECTION_OVERHEAD = 40  # Section headings and separators added around the packed parts
+
+
+def count_tokens(text):
+    """Cheap token estimate from the character count"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def truncate_tokens(text, max_tokens, keep="head"):
+    """Cut ``text`` to roughly ``max_tokens``, keeping its start ("head") or its end ("tail")"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+    limit = max(1, int(max_tokens * CHARS_PER_TOKEN) - 1)
+    return text[:limit] + "…" if keep == "head" else "…" + text[-limit:]
+
+
+def format_message(message):
+    role = "User" if message.get("role") == "user" else "Assistant"
+    return f"{role}: {message.get('content', '')}"
+
+
+class PromptBudget:
+    """Hands out tokens from a fixed budget and remembers what had to be cut"""
+
+    def __init__(self, total):
+        self.total = max(0, total)
+        self.used = 0
+        self.truncated = []
+        self.dropped = []
+
+    @property
+    def remaining(self):
+        return self.total - self.used
+
+    def take(self, name, text, max_tokens=None, keep="head"):
+        """Return as much of ``text`` as fits (optionally capped at ``max_tokens``) and charge it"""
+        if not text:
+            return ""
+        allowance = self.remaining if max_tokens is None else min(max_tokens, self.remaining)
+        fitted = truncate_tokens(text, allowance, keep)
+        if not fitted:
+            self.dropped.append(name)
+        elif fitted != text:
+            self.truncated.append(name)
+        self.used += count_tokens(fitted)
+        return fitted
+
+    def report(self):
+        return {"budget": self.total, "used": self.used, "truncated": self.truncated, "dropped": self.dropped}
+
+
+def assemble_prompt(turn_prompt, budget_tokens, db_context="", contexts=(), history=(), summary=""):
+    """Pack the prompt parts into ``budget_tokens`` and return ``(prompt, report)``
+
+    Space is granted in priority order: the turn itself, database context, retrieved
+    chunks (best first), the rolling summary and finally chat history, newest message
+    first. Whatever doesn't fit is truncated or dropped and listed in the report.
+    """
+    budget = PromptBudget(budget_tokens - SECTION_OVERHEAD)
+    turn = budget.take("turn", turn_prompt)
+    db_part = budget.take("db_context", db_context)
+    context_parts = [budget.take(f"context_{i}", text, CONTEXT_TOKENS) for i, text in enumerate(contexts)]
+    summary_part = budget.take("summary", summary)
+
+    history_lines = []
+    for i, message in enumerate(reversed(list(history))):
+        line = format_message(message)
+        if count_tokens(line) > budget.remaining:
+            budget.dropped.append(f"history ({len(history) - i} oldest messages)")
+            break
+        history_lines.insert(0, budget.take(f"history_{i}", line))
+
+    sections = []
+    if summary_part:
+        sections.append(f"Summary of the earlier conversation:\n{summary_part}")
+    if history_lines:
+        sections.append("Previous conversation:\n" + "\n".join(history_lines))
+    if db_part:
+        sections.append(f"Context information from database:\n{db_part}")
+    context_parts = [part for part in context_parts if part]
+    if context_parts:
+        sections.append("Retrieved context:\n" + "\n\n".join(context_parts))
+    sections.append(turn)
+    return "\n\n".join(sections), budget.report()
+
+
+class RollingSummary:
+    """Per-session summary of the messages that have aged out of the verbatim history
+
+    Updating it is an LLM call, so it runs as a background-lane scheduler job and
+    ``refresh`` only picks up the result on a later turn; the chat never waits for it.
+    Jobs are not tied to the chat session id, so a new message doesn't cancel them.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.covered = 0  # Number of leading messages folded into ``text``
+        self._job = None
+        self._job_covers = 0
+
+    def _poll(self):
+        if self._job is None:
+            return
+        if self._job.cancelled and self._job.finished_at is None:
+            self._job = None
+        elif self._job.finished_at is not None:
+            try:
+                self.text = strip_thinking(self._job.result().get("response", ""))
+                self.covered = self._job_covers
+            except Exception as e:
+                logger.warning(f"Conversation summary failed: {e}")
+            self._job = None
+
+    def refresh(self, messages, client, model):
+        """Collect a finished summary and start a new one if enough messages have aged out"""
+        self._poll()
+        aged_out = max(0, len(messages) - SUMMARY_KEEP_MESSAGES)
+        if self._job is not None or aged_out - self.covered < SUMMARY_BATCH:
+            return
+        new_lines = "\n".join(
+            truncate_tokens(format_message(message), SUMMARY_MESSAGE_TOKENS)
+            for message in messages[self.covered:aged_out]
+        )
+        prompt = (f"Current summary:\n{self.text or '(empty)'}\n\nNew messages:\n{new_lines}\n\n"
+                  "Rewrite the summary so it also covers the new messages. Keep names, goals and facts "
+                  "the user stated. Use at most 150 words and reply with the summary only.")
+        self._job_covers = aged_out
+        self._job = get_scheduler().submit(
+            lambda: [client.generate(prompt, model, options={"temperature": 0.0, "num_predict": 256})],
+            BACKGROUND,
+            source="conversation_summary"
+        )
+
+    def recent(self, messages):
+        """Messages not yet covered by the summary"""
+        return messages[self.covered:]
+
+    def discard(self, count):
+        """Call after dropping the ``count`` oldest messages so ``covered`` still indexes the list"""
+        self.covered = max(0, self.covered - count)
+        self._job_covers = max(0, self._job_covers - count)
+
+
+def get_rolling_summary(session_state):
+    """Return the session's RollingSummary, creating it on first use"""
+    return session_state.setdefault("conversation_summary", RollingSummary())
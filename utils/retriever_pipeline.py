@@ -1,44 +1,67 @@
 import streamlit as st
-from utils.build_graph import retrieve_from_graph
-from langchain_core.documents import Document
+import math
+import time
 import requests
+from utils.build_graph import retrieve_from_graph, retrieve_from_communities, retrieve_with_pagerank
+from utils.ollama_client import get_ollama_client
+from utils.llm_scheduler import get_scheduler, HYDE
+from utils.prompt_builder import truncate_tokens
+from utils.generation_governor import strip_thinking
+from utils.model_router import get_model_router
+
+HYDE_HISTORY_TOKENS = 512  # Only the most recent history is worth expanding the query with
 
 # 🚀 Query Expansion with HyDE
-def expand_query(query,uri,model):
+def expand_query(query, base_url, model):
+    router = get_model_router(model, base_url)
+    hyde_model = router.model_for("hyde")
+    started = time.perf_counter()
     try:
-        response = requests.post(uri, json={
-            "model": model,
-            "prompt": f"Generate a hypothetical answer to: {query}",
-            "stream": False
-        }).json()
-        return f"{query}\n{response.get('response', '')}"
+        response = get_scheduler().generate(
+            get_ollama_client(base_url),
+            f"Generate a hypothetical answer to: {query}",
+            hyde_model,
+            priority=HYDE,
+            session_id=st.session_state.get("llm_session_id")
+        )
+        router.record("hyde", hyde_model, time.perf_counter() - started)
+        return f"{query}\n{strip_thinking(response.get('response', ''))}"
     except Exception as e:
+        router.record("hyde", hyde_model, time.perf_counter() - started, ok=False)
+        if isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code == 404:
+            router.mark_missing(hyde_model)
         st.error(f"Query expansion failed: {str(e)}")
         return query
 
 
 # 🚀 Advanced Retrieval Pipeline
-def retrieve_documents(query, uri, model, chat_history=""):
-    expanded_query = expand_query(f"{chat_history}\n{query}", uri, model) if st.session_state.enable_hyde else query
+def retrieve_documents(query, base_url, model, chat_history=""):
+    if st.session_state.enable_hyde:
+        expanded_query = expand_query(f"{truncate_tokens(chat_history, HYDE_HISTORY_TOKENS, keep='tail')}\n{query}", base_url, model)
+    else:
+        expanded_query = query
     
     # 🔍 Retrieve documents using BM25 + FAISS
     docs = st.session_state.retrieval_pipeline["ensemble"].invoke(expanded_query)
 
     # 🚀 GraphRAG Retrieval
     if st.session_state.enable_graph_rag:
-        graph_results = retrieve_from_graph(query, st.session_state.retrieval_pipeline["knowledge_graph"])
+        knowledge_graph = st.session_state.retrieval_pipeline["knowledge_graph"]
+        if st.session_state.get("graph_rag_mode") == "Community":
+            graph_docs = retrieve_from_communities(query, knowledge_graph)
+        elif st.session_state.get("graph_rag_mode") == "PageRank":
+            graph_docs = retrieve_with_pagerank(query, knowledge_graph)
+        else:
+            graph_docs = retrieve_from_graph(query, knowledge_graph)
         
         # Debugging output
-        st.write(f"🔍 GraphRAG Retrieved Nodes: {graph_results}")
-
-        # Ensure graph results are correctly formatted
-        graph_docs = []
-        for node in graph_results:
-            graph_docs.append(Document(page_content=node))  # ✅ Fix: Correct Document initialization
+        st.write(f"🔍 GraphRAG Retrieved Chunks: {len(graph_docs)}")
 
         # If graph retrieval is successful, merge it with standard document retrieval
         if graph_docs:
-            docs = graph_docs + docs  # Merge GraphRAG results with FAISS + BM25 results
+            # Skip chunks the ensemble already returned so the reranker doesn't score them twice
+            seen = {doc.page_content for doc in graph_docs}
+            docs = graph_docs + [doc for doc in docs if doc.page_content not in seen]
     
     # 🚀 Neural Reranking (if enabled)
     if st.session_state.enable_reranking:
@@ -47,6 +70,11 @@ def retrieve_documents(query, uri, model, chat_history=""):
 
         # Sort documents based on reranking scores
         ranked_docs = [doc for _, doc in sorted(zip(scores, docs), reverse=True)]
+
+        # The best cross-encoder score says how useful the HyDE expansion was for this route
+        if st.session_state.enable_hyde and len(scores):
+            router = get_model_router(model, base_url)
+            router.record_quality("hyde", router.model_for("hyde"), 1 / (1 + math.exp(-float(max(scores)))))
     else:
         ranked_docs = docs
 
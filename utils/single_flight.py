@@ -0,0 +1,137 @@
+"""
+Single-flight coalescing - concurrent identical calls share one upstream request and its result
+"""
+import threading
+
+from utils.llm_metrics import get_llm_metrics
+
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _StreamFlight:
+    def __init__(self, start):
+        self.start = start
+        self.iterator = None
+        self.buffer = []
+        self.finished = False
+        self.error = None
+        self.pulling = False
+        self.subscribers = 0
+        self.cond = threading.Condition()
+
+
+class SingleFlight:
+    """Deduplicates in-flight calls by key
+
+    ``do`` runs ``fn`` once for all concurrent callers with the same key and hands
+    every caller the same result (or exception). ``stream`` does the same for
+    iterators: chunks go into a shared buffer that each subscriber replays from the
+    start, so a duplicate that joins late still sees the whole stream. Whichever
+    subscriber needs the next chunk pulls it from upstream; the upstream iterator is
+    closed once the last subscriber goes away. Upstream and coalesced calls are
+    counted per ``name`` in the LLM metrics.
+    """
+
+    def __init__(self, name, metrics=None):
+        self.name = name
+        self.metrics = metrics or get_llm_metrics()
+        self._flights = {}
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            self.metrics.increment("coalesced_calls", self.name)
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        self.metrics.increment("upstream_calls", self.name)
+        try:
+            flight.result = fn()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.event.set()
+
+    def stream(self, key, start):
+        """Return an iterator over the shared stream for ``key``; ``start`` creates the upstream iterable"""
+        with self._lock:
+            flight = self._streams.get(key)
+            if flight is None:
+                flight = self._streams[key] = _StreamFlight(start)
+                self.metrics.increment("upstream_calls", self.name)
+            else:
+                self.metrics.increment("coalesced_calls", self.name)
+            flight.subscribers += 1
+        return self._subscribe(key, flight)
+
+    def _finish(self, key, flight, error=None):
+        flight.finished = True
+        flight.error = error
+        with self._lock:
+            if self._streams.get(key) is flight:
+                del self._streams[key]
+
+    def _subscribe(self, key, flight):
+        index = 0
+        try:
+            while True:
+                pull = False
+                with flight.cond:
+                    while index >= len(flight.buffer) and not flight.finished and flight.pulling:
+                        flight.cond.wait()
+                    if index < len(flight.buffer):
+                        item = flight.buffer[index]
+                    elif flight.finished:
+                        if flight.error is not None:
+                            raise flight.error
+                        return
+                    else:
+                        flight.pulling = pull = True
+
+                if pull:
+                    try:
+                        if flight.iterator is None:
+                            flight.iterator = iter(flight.start())
+                        chunk = next(flight.iterator)
+                        with flight.cond:
+                            flight.buffer.append(chunk)
+                    except StopIteration:
+                        self._finish(key, flight)
+                    except Exception as e:
+                        self._finish(key, flight, e)
+                    finally:
+                        with flight.cond:
+                            flight.pulling = False
+                            flight.cond.notify_all()
+                    continue
+
+                index += 1
+                yield item
+        finally:
+            with self._lock:
+                flight.subscribers -= 1
+                abandoned = flight.subscribers == 0 and not flight.finished
+                if abandoned and self._streams.get(key) is flight:
+                    del self._streams[key]
+            if abandoned:
+                flight.finished = True
+                close = getattr(flight.iterator, "close", None)
+                if close:
+                    close()  # Nobody is listening any more; stop the upstream generation